@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.cache import cache
+
+PUBLIC_ROOMS_CACHE_KEY = 'chat:public-rooms'
+PUBLIC_ROOMS_CACHE_TIMEOUT = getattr(settings, 'CHAT_PUBLIC_ROOMS_CACHE_TIMEOUT', 300)
+
+
+def get_public_rooms():
+    return cache.get(PUBLIC_ROOMS_CACHE_KEY)
+
+
+def set_public_rooms(entry):
+    cache.set(PUBLIC_ROOMS_CACHE_KEY, entry, PUBLIC_ROOMS_CACHE_TIMEOUT)
+
+
+def invalidate_public_rooms():
+    cache.delete(PUBLIC_ROOMS_CACHE_KEY)
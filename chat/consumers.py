@@ -1,52 +1,161 @@
+import asyncio
 import json
 import logging
-from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message, RoomMembership
+from django.core.exceptions import ValidationError
+from .drain import DrainableMixin, load_resume_token
+from .frames import FrameSenderMixin
+from .models import ChatRoom, Message
+from .notifications import take_digest
+from .presence import PresenceMixin
+from .services import (
+    get_parent_message, ingest_message, resolve_direct_room, thread_group_name, user_group_name
+)
+from user.lookup import get_user_id
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
-class ChatRoomConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        self.room_link = self.scope['url_route']['kwargs']['room_link']
-        self.room_group_name = f'chat_{self.room_link}'
+class TokenAuthMixin:
+    """Authenticates a socket with the JWT sent in its ``Authorization`` header."""
 
-        headers = dict(self.scope['headers'])
-        token = None
+    def extract_token(self, headers):
         if b'authorization' in headers:
             auth_header = headers[b'authorization'].decode('utf8')
             if auth_header.startswith('Bearer '):
-                token = auth_header.split(' ')[1]
+                return auth_header.split(' ')[1]
+        return None
 
+    async def authenticate(self):
+        """Set and return ``scope['user']``, or close the socket and return None."""
+        token = self.extract_token(dict(self.scope['headers']))
         if not token:
             await self.close(code=4003, reason="No token provided.")
-            return
+            return None
 
         try:
             validated_token = UntypedToken(token)
             self.scope['user'] = await self.get_user(validated_token)
-        except (InvalidToken, TokenError) as e:
+        except (AuthenticationFailed, TokenError):
             await self.close(code=4003, reason="Invalid token.")
-            return
+            return None
+        return self.scope['user']
+
+    async def resume_user(self, state):
+        """
+        Restore ``scope['user']`` from a resume token instead of loading it.
+
+        The socket still has to send a valid JWT of the token's user; only its
+        signature is checked, so resuming does not touch the database. Closes
+        the socket and returns None otherwise.
+        """
+        token = self.extract_token(dict(self.scope['headers']))
+        if not token:
+            await self.close(code=4003, reason="No token provided.")
+            return None
+
+        try:
+            user_id = UntypedToken(token).get(api_settings.USER_ID_CLAIM)
+        except TokenError:
+            user_id = None
+        if user_id is None or str(user_id) != str(state['u']):
+            await self.close(code=4003, reason="Invalid token.")
+            return None
+
+        self.scope['user'] = User(pk=state['u'], username=state['n'])
+        return self.scope['user']
 
-        if not await self.is_member(self.scope['user'], self.room_link):
-            await self.close(code=4003, reason="User is not a member of this room.")
+    @database_sync_to_async
+    def get_user(self, validated_token):
+        jwt_auth = JWTAuthentication()
+        return jwt_auth.get_user(validated_token)
+
+
+class ThreadSubscriptionMixin:
+    """
+    Lets a socket follow reply threads of its rooms. Replies are published
+    to the thread's group only, not to the whole room.
+    """
+
+    def setup_threads(self):
+        self.threads = set()
+
+    async def handle_thread_action(self, data, room_ids):
+        """Handle (un)subscribe frames; returns False for frames of other kinds."""
+        action = data.get('action')
+        if action == 'subscribe_thread':
+            parent_id = data.get('parent')
+            if not await self.thread_in_rooms(parent_id, room_ids):
+                await self.send_payload({'type': 'error', 'errors': ["Thread does not exist in this room."]})
+            elif parent_id not in self.threads:
+                self.threads.add(parent_id)
+                await self.channel_layer.group_add(thread_group_name(parent_id), self.channel_name)
+            return True
+        if action == 'unsubscribe_thread':
+            parent_id = data.get('parent')
+            if parent_id in self.threads:
+                self.threads.discard(parent_id)
+                await self.channel_layer.group_discard(thread_group_name(parent_id), self.channel_name)
+            return True
+        return False
+
+    async def leave_threads(self):
+        await asyncio.gather(*(
+            self.channel_layer.group_discard(thread_group_name(parent_id), self.channel_name)
+            for parent_id in self.threads
+        ))
+
+    @database_sync_to_async
+    def thread_in_rooms(self, parent_id, room_ids):
+        return isinstance(parent_id, int) and Message.objects.filter(pk=parent_id, room_id__in=room_ids).exists()
+
+
+class ChatRoomConsumer(TokenAuthMixin, FrameSenderMixin, ThreadSubscriptionMixin, DrainableMixin, PresenceMixin,
+                       AsyncWebsocketConsumer):
+    async def connect(self):
+        self.setup_frames()
+        self.setup_threads()
+        self.room_link = self.scope['url_route']['kwargs']['room_link']
+        self.room_group_name = f'chat_{self.room_link}'
+
+        if await self.reject_if_draining():
             return
 
+        resume = load_resume_token(self.scope)
+        if resume and resume.get('l') == self.room_link:
+            if await self.resume_user(resume) is None:
+                return
+            self.room = ChatRoom(id=resume['r'], link=self.room_link)
+        else:
+            if await self.authenticate() is None:
+                return
+
+            self.room = await self.get_member_room(self.scope['user'], self.room_link)
+            if self.room is None:
+                await self.close(code=4003, reason="User is not a member of this room.")
+                return
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
         await self.accept()
+        self.register_connection()
+        await self.go_online(self.room.id)
 
     async def disconnect(self, close_code):
+        self.teardown_frames()
+        self.unregister_connection()
+        await self.go_offline()
+        await self.leave_threads()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -54,211 +163,293 @@ class ChatRoomConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if await self.handle_thread_action(data, [self.room.id]):
+            return
+
         message_content = data.get('message')
         message_type = data.get('message_type', 'TEXT')
 
         if message_content:
-            message = await self.save_message(self.scope['user'], self.room_link, message_content, message_type)
-
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'user': self.scope['user'].username,
-                    'message': message_content,
-                    'message_type': message_type,
-                    'timestamp': message.timestamp.isoformat(),
-                }
-            )
+            try:
+                await self.save_message(self.scope['user'], self.room, message_content, message_type, data.get('parent'))
+            except ValidationError as e:
+                await self.send_payload({'type': 'error', 'errors': e.messages})
 
     async def chat_message(self, event):
         # Send message to WebSocket
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
 
-    @database_sync_to_async
-    def get_user(self, validated_token):
-        jwt_auth = JWTAuthentication()
-        return jwt_auth.get_user(validated_token)
+    message_edited = message_deleted = chat_message
 
-    @database_sync_to_async
-    def is_member(self, user, room_link):
-        try:
-            room = ChatRoom.objects.get(link=room_link)
-            return RoomMembership.objects.filter(user=user, room=room).exists()
-        except ChatRoom.DoesNotExist:
-            return False
+    def resume_state(self):
+        return {'u': self.scope['user'].pk, 'n': self.scope['user'].username, 'r': self.room.id, 'l': self.room_link}
 
     @database_sync_to_async
-    def save_message(self, user, room_link, content, message_type):
-        room = ChatRoom.objects.get(link=room_link)
-        message = Message.objects.create(
-            user=user,
-            room=room,
-            content=content,
-            message_type=message_type
-        )
-        return message
-
+    def get_member_room(self, user, room_link):
+        return ChatRoom.objects.filter(link=room_link, memberships__user=user).first()
 
+    @database_sync_to_async
+    def save_message(self, user, room, content, message_type, parent_id=None):
+        return ingest_message(user, room, content, message_type, parent=get_parent_message(room, parent_id))
 
-logger = logging.getLogger(__name__)
 
-class DirectChatConsumer(AsyncWebsocketConsumer):
+class DirectChatConsumer(TokenAuthMixin, FrameSenderMixin, ThreadSubscriptionMixin, DrainableMixin, PresenceMixin,
+                         AsyncWebsocketConsumer):
     async def connect(self):
+        self.setup_frames()
+        self.setup_threads()
         self.other_user_username = self.scope['url_route']['kwargs']['username']
-        headers = dict(self.scope['headers'])
-        token = self.extract_token(headers)
-
-        if not token:
-            await self.close(code=4003, reason="No token provided.")
-            return
 
-        try:
-            validated_token = UntypedToken(token)
-            self.scope['user'] = await self.get_user(validated_token)
-        except (InvalidToken, TokenError):
-            await self.close(code=4003, reason="Invalid token.")
+        if await self.reject_if_draining():
             return
 
-        if not self.scope['user'].is_authenticated:
-            await self.close(code=4003, reason="User not authenticated.")
-            return
-
-        try:
-            self.other_user = await self.get_other_user(self.other_user_username)
-        except User.DoesNotExist:
-            await self.close(code=4003, reason="Other user does not exist.")
-            return
-
-        if self.scope['user'] == self.other_user:
-            await self.close(code=4003, reason="Cannot connect to yourself.")
-            return
-
-        self.room_link = self.create_room_link(self.scope['user'].username, self.other_user_username)
-
-        await self.ensure_room_exists(self.room_link)
+        resume = load_resume_token(self.scope)
+        if resume and resume.get('on') == self.other_user_username:
+            if await self.resume_user(resume) is None:
+                return
+            self.other_user = User(pk=resume['o'], username=self.other_user_username)
+            self.room = ChatRoom(id=resume['r'], link=resume['l'], room_type='DIRECT')
+        else:
+            if await self.authenticate() is None:
+                return
+
+            if not self.scope['user'].is_authenticated:
+                await self.close(code=4003, reason="User not authenticated.")
+                return
+
+            try:
+                self.other_user = await self.get_other_user(self.other_user_username)
+            except User.DoesNotExist:
+                await self.close(code=4003, reason="Other user does not exist.")
+                return
+
+            if self.scope['user'] == self.other_user:
+                await self.close(code=4003, reason="Cannot connect to yourself.")
+                return
+
+            # Resolved once per connection; messages are saved against this room directly
+            self.room = await self.get_direct_room(self.scope['user'], self.other_user)
+        self.room_link = self.room.link
+        self.room_group_name = self.room.group_name
 
         await self.channel_layer.group_add(
-            self.room_link,
+            self.room_group_name,
             self.channel_name
         )
 
         await self.accept()
+        self.register_connection()
+        await self.go_online(self.room.id)
         logger.info(f"User {self.scope['user'].username} connected to {self.room_link}")
 
         await self.send_previous_messages()
 
     async def disconnect(self, close_code):
+        self.teardown_frames()
+        self.unregister_connection()
+        await self.go_offline()
+        if not hasattr(self, 'room_group_name'):
+            return
         logger.info(f"User {self.scope['user'].username} disconnected from {self.room_link} with code {close_code}")
+        await self.leave_threads()
         await self.channel_layer.group_discard(
-            self.room_link,
+            self.room_group_name,
             self.channel_name
         )
 
     async def receive(self, text_data):
         try:
             data = json.loads(text_data)
+            if await self.handle_thread_action(data, [self.room.id]):
+                return
             message_content = data.get('message')
 
             if message_content:
                 message = await self.save_message(
                     user=self.scope['user'],
-                    other_user=self.other_user,
-                    content=message_content
+                    room=self.room,
+                    content=message_content,
+                    parent_id=data.get('parent'),
                 )
                 logger.info(f"Message saved: {message.content} from {message.user.username} in room {message.room.link}")
-
-                await self.channel_layer.group_send(
-                    self.room_link,
-                    {
-                        'type': 'chat_message',
-                        'user': self.scope['user'].username,
-                        'message': message_content,
-                        'timestamp': message.timestamp.isoformat(),
-                    }
-                )
+        except ValidationError as e:
+            await self.send_payload({'type': 'error', 'errors': e.messages})
         except Exception as e:
             logger.error(f"Error processing message: {e}")
             await self.close(code=4003, reason="Error processing message.")
 
     async def chat_message(self, event):
         try:
-            await self.send(text_data=json.dumps(event))
+            await self.send_event(event)
         except Exception as e:
             logger.error(f"Error sending message: {e}")
 
-    def extract_token(self, headers):
-        if b'authorization' in headers:
-            auth_header = headers[b'authorization'].decode('utf8')
-            if auth_header.startswith('Bearer '):
-                return auth_header.split(' ')[1]
-        return None
+    message_edited = message_deleted = chat_message
 
-    @database_sync_to_async
-    def get_user(self, validated_token):
-        jwt_auth = JWTAuthentication()
-        return jwt_auth.get_user(validated_token)
+    def resume_state(self):
+        return {
+            'u': self.scope['user'].pk,
+            'n': self.scope['user'].username,
+            'o': self.other_user.pk,
+            'on': self.other_user_username,
+            'r': self.room.id,
+            'l': self.room_link,
+        }
 
     @database_sync_to_async
     def get_other_user(self, username):
-        return User.objects.get(username=username)
-
-    def create_room_link(self, username1, username2):
-        return f'link_{"_".join(sorted([username1, username2]))}'
+        # Only the id is needed to address the other member, and it is served from cache
+        return User(pk=get_user_id(username), username=username)
 
     @database_sync_to_async
-    def ensure_room_exists(self, room_link):
-        room, created = ChatRoom.objects.get_or_create(
-            link=room_link,
-            defaults={
-                'name': room_link,
-                'room_type': 'DIRECT'
-            }
-        )
-        RoomMembership.objects.get_or_create(user=self.scope['user'], room=room)
-        RoomMembership.objects.get_or_create(user=self.other_user, room=room)
-        if created:
-            logger.info(f"Created new chat room with link: {room_link}")
-        return room
+    def get_direct_room(self, user, other_user):
+        return resolve_direct_room(user, other_user)
 
     @database_sync_to_async
-    def save_message(self, user, other_user, content):
-        room_link = self.create_room_link(user.username, other_user.username)
-        room = ChatRoom.objects.get(link=room_link)
-        return Message.objects.create(
-            user=user,
-            room=room,
-            content=content,
-            message_type='TEXT'
-        )
+    def save_message(self, user, room, content, parent_id=None):
+        return ingest_message(user, room, content, parent=get_parent_message(room, parent_id))
 
     @database_sync_to_async
-    def fetch_previous_messages(self, user, other_user):
-        room_link = self.create_room_link(user.username, other_user.username)
-        try:
-            room = ChatRoom.objects.get(link=room_link)
-            return Message.objects.filter(room=room).order_by('timestamp')
-        except ChatRoom.DoesNotExist:
-            return []
-    @sync_to_async
-    def send_previous_messages(self):
-        try:
-            messages = self.fetch_previous_messages(self.scope['user'], self.other_user)
-            message_list = []
-            for message in messages:
-                message_list.append({
-                    'user': message.user.username,
-                    'message': message.content,
-                    'timestamp': message.timestamp.isoformat(),
-                    'message_type': message.message_type,
-                })
+    def fetch_previous_messages(self, room):
+        return [
+            {
+                'id': message_id,
+                'parent': parent_id,
+                'user': username,
+                'message': content,
+                'timestamp': timestamp.isoformat(),
+                'message_type': message_type,
+            }
+            for message_id, parent_id, username, content, timestamp, message_type in Message.objects.filter(
+                room=room, is_deleted=False,
+            )
+            .order_by('timestamp')
+            .values_list('id', 'parent_id', 'user__username', 'content', 'timestamp', 'message_type')
+        ]
 
+    async def send_previous_messages(self):
+        try:
+            message_list = await self.fetch_previous_messages(self.room)
             if message_list:
-                self.send(text_data=json.dumps({
+                await self.send_payload({
                     'type': 'previous_messages',
                     'messages': message_list
-                }))
+                })
                 logger.info(f"Sent previous messages to {self.scope['user'].username}")
         except Exception as e:
             logger.error(f"Error sending previous messages: {e}")
-            self.close(code=4003, reason="Error sending previous messages")
\ No newline at end of file
+            await self.close(code=4003, reason="Error sending previous messages")
+
+
+class UserChatConsumer(TokenAuthMixin, FrameSenderMixin, ThreadSubscriptionMixin, DrainableMixin, PresenceMixin,
+                       AsyncWebsocketConsumer):
+    """
+    One socket per user, subscribed to every room the user is a member of.
+
+    Outgoing events carry the room id they belong to; incoming frames name
+    the room with ``{"action": "send", "room": <id>, "message": ...}``.
+    Rooms joined or left while connected are (un)subscribed through events
+    sent to the user's own group. What was missed while the user had no
+    socket open on a room arrives in a ``notifications`` frame on connect.
+    """
+
+    async def connect(self):
+        self.setup_frames()
+        self.setup_threads()
+        self.rooms = {}
+        if await self.reject_if_draining():
+            return
+
+        resume = load_resume_token(self.scope)
+        if resume and 'rs' in resume:
+            user = await self.resume_user(resume)
+            if user is None:
+                return
+            rooms = {room_id: ChatRoom(id=room_id, link=link) for room_id, link in resume['rs']}
+        else:
+            user = await self.authenticate()
+            if user is None:
+                return
+            rooms = await self.get_member_rooms(user)
+
+        self.user_group_name = user_group_name(user.pk)
+        self.rooms = rooms
+        groups = [self.user_group_name, *(room.group_name for room in self.rooms.values())]
+        await asyncio.gather(*(self.channel_layer.group_add(group, self.channel_name) for group in groups))
+
+        await self.accept()
+        self.register_connection()
+        await self.send_payload({
+            'type': 'subscribed',
+            'rooms': [{'room': room.id, 'link': room.link} for room in self.rooms.values()],
+        })
+        await self.go_online()
+        digest = await database_sync_to_async(take_digest)(user.pk)
+        if digest:
+            await self.send_payload({'type': 'notifications', 'rooms': digest})
+
+    async def disconnect(self, close_code):
+        self.teardown_frames()
+        self.unregister_connection()
+        await self.go_offline()
+        if not hasattr(self, 'user_group_name'):
+            return
+        await self.leave_threads()
+        groups = [self.user_group_name, *(room.group_name for room in self.rooms.values())]
+        await asyncio.gather(*(self.channel_layer.group_discard(group, self.channel_name) for group in groups))
+
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+        if await self.handle_thread_action(data, list(self.rooms)):
+            return
+        if data.get('action') != 'send':
+            await self.send_error(f"Unknown action: {data.get('action')}.")
+            return
+
+        room = self.rooms.get(data.get('room'))
+        if room is None:
+            await self.send_error("User is not a member of this room.")
+            return
+
+        try:
+            await self.save_message(
+                self.scope['user'], room, data.get('message'), data.get('message_type', 'TEXT'), data.get('parent')
+            )
+        except ValidationError as e:
+            await self.send_error(*e.messages)
+
+    async def chat_message(self, event):
+        await self.send_event(event)
+
+    message_edited = message_deleted = chat_message
+
+    async def membership_added(self, event):
+        room = ChatRoom(id=event['room'], link=event['link'])
+        if room.id not in self.rooms:
+            self.rooms[room.id] = room
+            await self.channel_layer.group_add(room.group_name, self.channel_name)
+        await self.send_payload(event)
+
+    async def membership_removed(self, event):
+        room = self.rooms.pop(event['room'], None)
+        if room is not None:
+            await self.channel_layer.group_discard(room.group_name, self.channel_name)
+        await self.send_payload(event)
+
+    async def send_error(self, *errors):
+        await self.send_payload({'type': 'error', 'errors': list(errors)})
+
+    def resume_state(self):
+        return {
+            'u': self.scope['user'].pk,
+            'n': self.scope['user'].username,
+            'rs': [[room.id, room.link] for room in self.rooms.values()],
+        }
+
+    @database_sync_to_async
+    def get_member_rooms(self, user):
+        return {room.id: room for room in ChatRoom.objects.filter(memberships__user=user).only('id', 'link')}
+
+    @database_sync_to_async
+    def save_message(self, user, room, content, message_type, parent_id=None):
+        return ingest_message(user, room, content, message_type, parent=get_parent_message(room, parent_id))
@@ -0,0 +1,112 @@
+"""
+Connection draining for rolling deploys.
+
+On ``SIGUSR1`` the process stops accepting sockets and tells every open
+socket to reconnect after a random delay, handing it a signed resume token.
+A socket reconnecting with ``?resume=<token>`` within
+``CHAT_RESUME_TOKEN_MAX_AGE`` seconds, and with a JWT of the same user,
+skips the user and membership lookups it did on its first connect.
+"""
+
+import asyncio
+import logging
+import random
+import signal
+import threading
+import weakref
+from urllib.parse import parse_qs
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+RESUME_TOKEN_MAX_AGE = getattr(settings, 'CHAT_RESUME_TOKEN_MAX_AGE', 300)
+RECONNECT_JITTER_MS = getattr(settings, 'CHAT_RECONNECT_JITTER_MS', 10000)
+RESUME_TOKEN_SALT = 'chat.resume'
+
+# WebSocket close code for "Service Restart"
+SERVICE_RESTART = 1012
+
+
+def make_resume_token(state):
+    return signing.dumps(state, salt=RESUME_TOKEN_SALT, compress=True)
+
+
+def load_resume_token(scope):
+    """Return the state carried by the connection's resume token, or None."""
+    token = parse_qs(scope.get('query_string', b'').decode()).get('resume')
+    if not token:
+        return None
+    try:
+        return signing.loads(token[0], salt=RESUME_TOKEN_SALT, max_age=RESUME_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+class ConnectionRegistry:
+    """Open sockets of this process."""
+
+    def __init__(self):
+        self.consumers = weakref.WeakSet()
+        self.draining = False
+        self.loop = None
+
+    def register(self, consumer):
+        self.loop = asyncio.get_running_loop()
+        self.consumers.add(consumer)
+
+    def unregister(self, consumer):
+        self.consumers.discard(consumer)
+
+    def start_drain(self):
+        """Begin draining; safe to call from a signal handler or another thread."""
+        self.draining = True
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.drain()))
+
+    async def drain(self):
+        consumers = list(self.consumers)
+        logger.info(f"Draining {len(consumers)} connections")
+        await asyncio.gather(
+            *(consumer.drain(random.randint(0, RECONNECT_JITTER_MS)) for consumer in consumers),
+            return_exceptions=True,
+        )
+
+
+registry = ConnectionRegistry()
+
+
+def install_drain_signal(signum=signal.SIGUSR1):
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signum, lambda *args: registry.start_drain())
+
+
+class DrainableMixin:
+    """
+    Consumer mixin taking part in draining. Consumers must define
+    ``resume_state()`` returning what they need to skip their lookups on
+    reconnect; it is signed into the resume token sent by ``drain``.
+    """
+
+    async def reject_if_draining(self):
+        if registry.draining:
+            await self.close(code=SERVICE_RESTART)
+            return True
+        return False
+
+    def register_connection(self):
+        registry.register(self)
+
+    def unregister_connection(self):
+        registry.unregister(self)
+
+    async def drain(self, after_ms):
+        # Events of the current batch window would otherwise be dropped with the socket
+        await self.flush_events()
+        await self.send_payload({
+            'type': 'reconnect',
+            'after_ms': after_ms,
+            'resume_token': make_resume_token(self.resume_state()),
+        })
+        await self.close(code=SERVICE_RESTART)
@@ -0,0 +1,69 @@
+"""
+Streaming export of room history.
+
+Rows are read with a chunked server-side iterator and written out as they
+arrive, so memory use does not grow with the size of the room. Every NDJSON
+line carries the message id; passing the last received id as ``after``
+resumes an interrupted export.
+"""
+
+import json
+import zlib
+from itertools import islice
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import Message
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'CHAT_EXPORT_CHUNK_SIZE', 2000)
+
+
+def export_rows(room, after=None):
+    messages = (
+        Message.objects.filter(room=room, is_deleted=False)
+        .select_related('user')
+        .only('id', 'content', 'message_type', 'file', 'parent_id', 'timestamp', 'user__username')
+        .order_by('id')
+    )
+    if after is not None:
+        messages = messages.filter(id__gt=after)
+    for message in messages.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'id': message.id,
+            'user': message.user.username,
+            'message': message.content,
+            'message_type': message.message_type,
+            'file': message.file.name or None,
+            'parent': message.parent_id,
+            'timestamp': message.timestamp.isoformat(),
+        }
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield (json.dumps(row) + '\n').encode()
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def iterate_in_thread(iterable, batch_size=EXPORT_CHUNK_SIZE):
+    """
+    Serve a synchronous, database backed iterator to an ASGI response.
+
+    Django would otherwise materialize a sync iterator in full before
+    streaming it. Batches are pulled on the same thread that opened the
+    cursor.
+    """
+    iterator = iter(iterable)
+    next_batch = sync_to_async(lambda: list(islice(iterator, batch_size)))
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        yield b''.join(batch)
@@ -0,0 +1,125 @@
+"""
+Encoding of outgoing WebSocket frames.
+
+Clients opt in through the connection query string:
+
+* ``schema=compact`` replaces the verbose keys with short ones and sends
+  timestamps as epoch milliseconds.
+* ``compress=deflate`` sends frames of at least ``CHAT_FRAME_COMPRESS_THRESHOLD``
+  bytes as binary frames holding raw-deflated JSON.
+* ``batch=window`` micro-batches chat events: the first event is sent
+  immediately and events arriving within the following
+  ``CHAT_FRAME_BATCH_WINDOW_MS`` are delivered together in one ``batch``
+  frame.
+
+Without options every event is sent as its own frame with the verbose keys.
+"""
+
+import asyncio
+import json
+import zlib
+from datetime import datetime
+from urllib.parse import parse_qs
+from django.conf import settings
+
+COMPRESS_THRESHOLD = getattr(settings, 'CHAT_FRAME_COMPRESS_THRESHOLD', 1024)
+BATCH_WINDOW_MS = getattr(settings, 'CHAT_FRAME_BATCH_WINDOW_MS', 5)
+
+COMPACT_KEYS = {
+    'type': 't',
+    'id': 'i',
+    'room': 'r',
+    'parent': 'p',
+    'link': 'l',
+    'user': 'u',
+    'message': 'm',
+    'message_type': 'k',
+    'timestamp': 'ts',
+    'updated_at': 'ua',
+    'messages': 'ms',
+    'events': 'e',
+    'rooms': 'rs',
+    'errors': 'er',
+    'count': 'c',
+    'preview': 'pv',
+}
+
+
+def compact(value, key=None):
+    """Rewrite a frame payload to the compact schema."""
+    if isinstance(value, dict):
+        return {COMPACT_KEYS.get(k, k): compact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [compact(item) for item in value]
+    if key in ('timestamp', 'updated_at') and isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    return value
+
+
+class FrameEncoder:
+    def __init__(self, compact_schema=False, compress=False, batch=False, threshold=COMPRESS_THRESHOLD):
+        self.compact_schema = compact_schema
+        self.compress = compress
+        self.batch = batch
+        self.threshold = threshold
+
+    @classmethod
+    def from_scope(cls, scope):
+        params = parse_qs(scope.get('query_string', b'').decode())
+        return cls(
+            compact_schema=params.get('schema') == ['compact'],
+            compress=params.get('compress') == ['deflate'],
+            batch=params.get('batch') == ['window'],
+        )
+
+    def encode(self, payload):
+        """Return the keyword arguments for ``send`` carrying ``payload``."""
+        if self.compact_schema:
+            payload = compact(payload)
+        text = json.dumps(payload, separators=(',', ':') if self.compact_schema else None)
+        if self.compress and len(text) >= self.threshold:
+            compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+            return {'bytes_data': compressor.compress(text.encode()) + compressor.flush()}
+        return {'text_data': text}
+
+
+class FrameSenderMixin:
+    """Consumer mixin sending payloads through the connection's negotiated encoding."""
+
+    batch_window = BATCH_WINDOW_MS / 1000
+
+    def setup_frames(self):
+        self.frame_encoder = FrameEncoder.from_scope(self.scope)
+        self._pending_events = []
+        self._batch_window = None
+
+    async def send_payload(self, payload):
+        await self.send(**self.frame_encoder.encode(payload))
+
+    async def send_event(self, event):
+        if self._batch_window is not None:
+            self._pending_events.append(event)
+            return
+        await self.send_payload(event)
+        if self.frame_encoder.batch and self.batch_window > 0:
+            self._batch_window = asyncio.ensure_future(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.batch_window)
+        self._batch_window = None
+        await self.flush_events()
+
+    async def flush_events(self):
+        """Send the events held back by the current batch window right away."""
+        if self._batch_window is not None:
+            self._batch_window.cancel()
+            self._batch_window = None
+        events, self._pending_events = self._pending_events, []
+        if len(events) == 1:
+            await self.send_payload(events[0])
+        elif events:
+            await self.send_payload({'type': 'batch', 'events': events})
+
+    def teardown_frames(self):
+        if getattr(self, '_batch_window', None) is not None:
+            self._batch_window.cancel()
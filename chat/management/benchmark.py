@@ -0,0 +1,62 @@
+"""
+Shared plumbing for the ``bench_*`` management commands.
+
+Benchmarks run against a freshly migrated throwaway database and, unless
+asked otherwise, an in-memory channel layer, so they never touch
+``db.sqlite3`` or Redis.
+"""
+
+import statistics
+import time
+from contextlib import contextmanager, nullcontext
+from django.db import connections
+from django.test.utils import override_settings
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@contextmanager
+def isolated_environment(database=None, channel_layers=IN_MEMORY_CHANNEL_LAYERS):
+    """
+    ``database`` puts the test database in that file instead of in memory,
+    for runs writing to it from several threads at once. ``channel_layers``
+    replaces ``CHANNEL_LAYERS``; None keeps the configured layer.
+    """
+    connection = connections['default']
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+    if database:
+        connection.settings_dict['TEST']['NAME'] = database
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(CHANNEL_LAYERS=channel_layers) if channel_layers else nullcontext():
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+
+
+def timed(func, iterations):
+    """Call ``func`` ``iterations`` times and return the per-call latencies in seconds."""
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'per_second': len(ordered) / sum(ordered) if sum(ordered) else 0,
+        'p50_ms': statistics.median(ordered) * 1000,
+        'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
+
+
+def format_summary(label, summary):
+    return (f"{label:<32} {summary['per_second']:>10.0f}/s  "
+            f"p50 {summary['p50_ms']:>8.3f} ms  p99 {summary['p99_ms']:>8.3f} ms")
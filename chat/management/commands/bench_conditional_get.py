@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+from chat.management.benchmark import format_summary, isolated_environment, summarize, timed
+from chat.models import ChatRoom
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure requests/sec of full and conditional GETs on the room and user endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--iterations', type=int, default=500)
+
+    def handle(self, *args, **options):
+        with isolated_environment():
+            user = User.objects.create(username='bench')
+            ChatRoom.objects.bulk_create(
+                [ChatRoom(name=f'Room {i}', link=f'room_{i}', room_type='PUBLIC') for i in range(options['rooms'])]
+            )
+            client = APIClient()
+            client.force_authenticate(user)
+
+            for label, path in [('public rooms', '/chat/rooms/'),
+                                ('room detail', '/chat/room-detail/room_0/'),
+                                ('user detail', f'/user/users/{user.pk}/')]:
+                etag = client.get(path)['ETag']
+                full = summarize(timed(lambda: client.get(path), options['iterations']))
+                conditional = summarize(timed(lambda: client.get(path, HTTP_IF_NONE_MATCH=etag), options['iterations']))
+                self.stdout.write(format_summary(f'{label} (200)', full))
+                self.stdout.write(format_summary(f'{label} (304)', conditional))
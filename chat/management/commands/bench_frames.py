@@ -0,0 +1,55 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat.frames import FrameEncoder
+
+
+class Command(BaseCommand):
+    help = 'Compare size and encoding cost of the verbose, compact and compressed frame formats.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--history', type=int, default=500, help='Messages in the history frame.')
+        parser.add_argument('--burst', type=int, default=20, help='Chat events arriving within one batch window.')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        events = [
+            {
+                'type': 'chat_message',
+                'id': i,
+                'room': 42,
+                'user': f'user{i % 7}',
+                'message': f'Message number {i} in a fairly ordinary conversation',
+                'message_type': 'TEXT',
+                'timestamp': (now + timedelta(seconds=i)).isoformat(),
+            }
+            for i in range(max(options['history'], options['burst']))
+        ]
+        history = {'type': 'previous_messages', 'messages': events[:options['history']]}
+        burst = events[:options['burst']]
+
+        encoders = [
+            ('verbose', FrameEncoder()),
+            ('compact', FrameEncoder(compact_schema=True)),
+            ('verbose + deflate', FrameEncoder(compress=True)),
+            ('compact + deflate', FrameEncoder(compact_schema=True, compress=True)),
+        ]
+        self.stdout.write(f"{'format':<20} {'history bytes':>14} {'encode us':>10} "
+                          f"{'burst bytes (1/event)':>22} {'burst bytes (batch)':>20}")
+        for label, encoder in encoders:
+            start = time.perf_counter()
+            for _ in range(options['iterations']):
+                frame = encoder.encode(history)
+            elapsed = (time.perf_counter() - start) / options['iterations']
+
+            single = sum(self.frame_size(encoder.encode(event)) for event in burst)
+            batched = self.frame_size(encoder.encode({'type': 'batch', 'events': burst}))
+            self.stdout.write(f'{label:<20} {self.frame_size(frame):>14} {elapsed * 1e6:>10.0f} '
+                              f'{single:>22} {batched:>20}')
+
+    def frame_size(self, frame):
+        if 'bytes_data' in frame:
+            return len(frame['bytes_data'])
+        return len(frame['text_data'].encode())
@@ -0,0 +1,37 @@
+import random
+import string
+import time
+from django.core.management.base import BaseCommand
+from chat.moderation import TermMatcher
+
+
+class Command(BaseCommand):
+    help = 'Measure compile time and per-message screening cost of the moderation term matcher.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--terms', type=int, default=50000)
+        parser.add_argument('--messages', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        terms = [
+            ''.join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 12)))
+            for _ in range(options['terms'])
+        ]
+
+        start = time.perf_counter()
+        matcher = TermMatcher(terms)
+        self.stdout.write(f"compiled {len(terms)} terms into {len(matcher)} states "
+                          f"in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        words = ['hello', 'there', 'how', 'is', 'everyone', 'doing', 'today', 'see', 'you', 'at', 'the', 'meeting']
+        clean = [' '.join(rng.choices(words, k=rng.randint(5, 40))) for _ in range(options['messages'])]
+        dirty = [f'{message} {rng.choice(terms)}' for message in clean]
+
+        for label, messages in (('clean', clean), ('with a term', dirty)):
+            start = time.perf_counter()
+            matched = sum(1 for message in messages if matcher.find(message))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"{label:<12} {elapsed / len(messages) * 1e6:>8.1f} us/message  "
+                              f"{matched}/{len(messages)} matched")
@@ -0,0 +1,64 @@
+import time
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+from chat.management.benchmark import isolated_environment
+from chat.models import ChatRoom, RoomMembership
+from chat.outbox import publish_outbox, publisher
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare onboarding users into rooms one request per membership against the bulk endpoints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--rooms', type=int, default=10)
+        parser.add_argument('--single-users', type=int, default=500,
+                            help='Users onboarded through the per-membership endpoint; the rate is extrapolated.')
+
+    def handle(self, *args, **options):
+        # Events are published inline after each run: the in-memory test database
+        # cannot be written from the publisher thread concurrently
+        with isolated_environment(), mock.patch.object(publisher, 'schedule'):
+            admin = User.objects.create(username='admin', is_staff=True)
+            users = User.objects.bulk_create([User(username=f'user{i}') for i in range(options['users'])])
+            admin_client = APIClient()
+            admin_client.force_authenticate(admin)
+
+            # One request per room, then one request per membership
+            single_users = users[:options['single_users']]
+            clients = []
+            for user in single_users:
+                client = APIClient()
+                client.force_authenticate(user)
+                clients.append(client)
+            start = time.perf_counter()
+            links = []
+            for i in range(options['rooms']):
+                response = admin_client.post('/chat/new-room/', {'name': f'Single {i}', 'link': f'single_{i}'})
+                links.append(response.data['room']['link'])
+            for link in links:
+                for client in clients:
+                    client.post(f'/chat/add-membership/?room_link={link}')
+            publish_outbox()
+            single = time.perf_counter() - start
+            memberships = options['rooms'] * len(single_users)
+            self.stdout.write(f"{'per-membership requests':<28} {memberships / single:>10.0f} memberships/s  "
+                              f"(~{single * len(users) / len(single_users):.1f} s for {len(users)} users)")
+
+            start = time.perf_counter()
+            response = admin_client.post('/chat/new-rooms/', {
+                'rooms': [{'name': f'Bulk {i}', 'link': f'bulk_{i}'} for i in range(options['rooms'])]
+            }, format='json')
+            user_ids = [user.pk for user in users]
+            for room in response.data['rooms']:
+                admin_client.post(f"/chat/room-members/{room['link']}/", {'users': user_ids}, format='json')
+            publish_outbox()
+            bulk = time.perf_counter() - start
+            memberships = RoomMembership.objects.filter(room__link__startswith='bulk_', role='MEMBER').count()
+            self.stdout.write(f"{'bulk requests':<28} {memberships / bulk:>10.0f} memberships/s  "
+                              f"({bulk:.1f} s for {len(users)} users)")
+            assert ChatRoom.objects.filter(link__startswith='bulk_').count() == options['rooms']
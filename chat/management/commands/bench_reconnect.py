@@ -0,0 +1,70 @@
+import asyncio
+import random
+import time
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+from chat.drain import make_resume_token
+from chat.management.benchmark import isolated_environment, summarize
+from chat.models import ChatRoom, RoomMembership
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Simulate a thundering herd of reconnects with and without resume tokens.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--rooms', type=int, default=50, help='Rooms each client is a member of.')
+        parser.add_argument('--jitter-ms', type=int, default=1000, help='Reconnect spread of the jittered run.')
+
+    def handle(self, *args, **options):
+        from config.asgi import application
+
+        with isolated_environment():
+            users = User.objects.bulk_create([User(username=f'user{i}') for i in range(options['clients'])])
+            rooms = ChatRoom.objects.bulk_create(
+                [ChatRoom(name=f'Room {i}', link=f'room_{i}') for i in range(options['rooms'])]
+            )
+            RoomMembership.objects.bulk_create(
+                [RoomMembership(user=user, room=room) for user in users for room in rooms]
+            )
+
+            auth = {user.pk: [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())] for user in users}
+            jwt_clients = [('/ws/user/', auth[user.pk]) for user in users]
+            room_state = [[room.id, room.link] for room in rooms]
+            # Resuming skips the lookups but still needs the user's JWT
+            resume_clients = [
+                (f"/ws/user/?resume={make_resume_token({'u': user.pk, 'n': user.username, 'rs': room_state})}",
+                 auth[user.pk])
+                for user in users
+            ]
+
+            runs = [
+                ('reconnect with JWT', jwt_clients, 0),
+                ('reconnect with resume token', resume_clients, 0),
+                ('resume token + jitter', resume_clients, options['jitter_ms']),
+            ]
+            for label, clients, jitter_ms in runs:
+                latencies, elapsed = async_to_sync(self.herd)(application, clients, jitter_ms)
+                summary = summarize(latencies)
+                self.stdout.write(f"{label:<32} {len(clients) / elapsed:>8.0f} handshakes/s  "
+                                  f"p50 {summary['p50_ms']:>8.1f} ms  p99 {summary['p99_ms']:>8.1f} ms")
+
+    async def herd(self, application, clients, jitter_ms):
+        async def connect(path, headers):
+            await asyncio.sleep(random.uniform(0, jitter_ms / 1000))
+            communicator = WebsocketCommunicator(application, path, headers=[(b'host', b'localhost'), *headers])
+            start = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=60)
+            latency = time.perf_counter() - start
+            assert connected
+            await communicator.disconnect()
+            return latency
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(connect(path, headers) for path, headers in clients))
+        return latencies, time.perf_counter() - start
@@ -0,0 +1,69 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Runs in a fresh interpreter so that nothing is imported before the entry point
+CHILD = '''
+import importlib, json, os, sys, time
+os.environ['DJANGO_SETTINGS_MODULE'] = sys.argv[2]
+start = time.perf_counter()
+entry = importlib.import_module(sys.argv[1])
+imported = time.perf_counter() - start
+ready = time.time() - float(sys.argv[3])
+modules = len(sys.modules)
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.tokens import AccessToken
+from chat.management.benchmark import isolated_environment
+
+async def handshake(headers):
+    communicator = WebsocketCommunicator(entry.application, '/ws/user/', headers=[(b'host', b'localhost'), *headers])
+    start = time.perf_counter()
+    connected, _ = await communicator.connect(timeout=30)
+    elapsed = time.perf_counter() - start
+    assert connected
+    await communicator.disconnect()
+    return elapsed
+
+with isolated_environment():
+    user = get_user_model().objects.create(username='bench')
+    headers = [(b'authorization', f'Bearer {AccessToken.for_user(user)}'.encode())]
+    first = async_to_sync(handshake)(headers)
+    warm = async_to_sync(handshake)(headers)
+
+print(json.dumps({'ready': ready, 'imported': imported, 'modules': modules, 'first': first, 'warm': warm}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure import time and time to the first accepted WebSocket of each ASGI entry point.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        entry_points = [
+            ('config.asgi', 'config.settings'),
+            ('config.asgi_ws', 'config.settings_ws'),
+        ]
+        self.stdout.write(f"{'entry point':<16} {'modules':>8} {'import ms':>10} {'process ready ms':>17} "
+                          f"{'first accept ms':>16} {'warm accept ms':>15}")
+        for module, settings_module in entry_points:
+            runs = [self.run_child(module, settings_module) for _ in range(options['runs'])]
+            median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            self.stdout.write(f"{module:<16} {median['modules']:>8.0f} {median['imported'] * 1000:>10.1f} "
+                              f"{median['ready'] * 1000:>17.1f} {median['first'] * 1000:>16.1f} "
+                              f"{median['warm'] * 1000:>15.1f}")
+
+    def run_child(self, module, settings_module):
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD, module, settings_module, repr(time.time())],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from chat.models import ChatRoom
+from chat.services import broadcast_message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Post one message to many rooms and fan it out to their live sockets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message')
+        parser.add_argument('--user', required=True, help='Username the message is posted as.')
+        parser.add_argument('--rooms', nargs='+', help='Links of the target rooms.')
+        parser.add_argument('--room-type', choices=('PUBLIC', 'PRIVATE'), help='Target every room of this type.')
+
+    def handle(self, *args, **options):
+        if not options['rooms'] and not options['room_type']:
+            raise CommandError('Either --rooms or --room-type must be provided.')
+
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['user']} does not exist.")
+
+        rooms = ChatRoom.objects.exclude(room_type='DIRECT').only('id', 'link')
+        if options['rooms']:
+            rooms = rooms.filter(link__in=options['rooms'])
+        if options['room_type']:
+            rooms = rooms.filter(room_type=options['room_type'])
+        rooms = list(rooms)
+        if not rooms:
+            raise CommandError('No matching rooms found.')
+
+        def progress(sent, total):
+            self.stdout.write(f'Dispatched {sent}/{total} rooms')
+
+        try:
+            broadcast_message(user, rooms, options['message'], progress=progress)
+        except Exception as e:
+            # The messages are saved and their events left in the outbox
+            self.stderr.write(self.style.WARNING(
+                f'Broadcast saved to {len(rooms)} rooms but not delivered ({e}); run publish_outbox to retry'
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Broadcast sent to {len(rooms)} rooms'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from chat.notifications import PUSH_BATCH_SIZE, deliver_pending
+
+
+class Command(BaseCommand):
+    help = 'Hand pending offline notifications to the configured push sink.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='Seconds a room must have been quiet before its members are pushed.')
+        parser.add_argument('--batch-size', type=int, default=PUSH_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        delivered = deliver_pending(min_age=options['min_age'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} notifications'))
@@ -0,0 +1,32 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from chat.export import export_rows, gzipped, ndjson_lines
+from chat.models import ChatRoom
+
+
+class Command(BaseCommand):
+    help = "Stream a room's history as NDJSON, optionally gzipped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('room_link')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--after', type=int, help='Resume after this message id.')
+
+    def handle(self, *args, **options):
+        try:
+            room = ChatRoom.objects.get(link=options['room_link'])
+        except ChatRoom.DoesNotExist:
+            raise CommandError(f"Room {options['room_link']} does not exist.")
+
+        chunks = ndjson_lines(export_rows(room, after=options['after']))
+        if options['gzip']:
+            chunks = gzipped(chunks)
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from chat.outbox import publish_outbox, release_stale_claims
+
+
+class Command(BaseCommand):
+    help = 'Publish outbox events left behind by stopped or crashed workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=60,
+                            help='Seconds after which a claimed but unpublished event is retried.')
+
+    def handle(self, *args, **options):
+        released = release_stale_claims(options['stale_after'])
+        if released:
+            self.stdout.write(f'Released {released} stale claims')
+        published = publish_outbox()
+        self.stdout.write(self.style.SUCCESS(f'Published {published} events'))
@@ -0,0 +1,353 @@
+import asyncio
+import itertools
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from unittest import mock
+from urllib.parse import urlencode
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve
+from rest_framework_simplejwt.tokens import AccessToken
+from chat.management.benchmark import IN_MEMORY_CHANNEL_LAYERS, isolated_environment, summarize
+from chat.models import ChatRoom, RoomMembership
+from chat.outbox import OUTBOX_WINDOW_MS, publish_outbox, publisher
+from chat.recorder import TrafficRecorder
+
+User = get_user_model()
+
+TOKEN = re.compile(r'~(\d+)~')
+
+
+def load_recording(path):
+    """Events of a recording on one timeline, with connection ids made unique across segments."""
+    events, start, segment = [], None, 0
+    with open(path, encoding='utf8') as recording:
+        for line in recording:
+            record = json.loads(line)
+            if 'v' in record:
+                segment += 1
+                start = record['start']
+                continue
+            record['t'] += start
+            if 'c' in record:
+                record['c'] = (segment, record['c'])
+            events.append(record)
+    if not events:
+        raise CommandError(f'No events in {path}.')
+    first = min(event['t'] for event in events)
+    for event in events:
+        event['t'] -= first
+    return sorted(events, key=lambda event: event['t'])
+
+
+def frame_messages(message):
+    """Contents of the chat events in an outgoing frame, whatever encoding was negotiated."""
+    if message['type'] != 'websocket.send':
+        return []
+    if message.get('bytes') is not None:
+        payload = json.loads(zlib.decompress(message['bytes'], -zlib.MAX_WBITS))
+    else:
+        payload = json.loads(message['text'])
+    events = payload.get('events') or payload.get('e') or [payload]
+    return [event.get('message') or event.get('m') for event in events if isinstance(event, dict)]
+
+
+class Command(BaseCommand):
+    help = ('Replay a recorded traffic shape against the in-process ASGI application and a seeded database, '
+            'reporting latency and throughput.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('recording')
+        parser.add_argument('--speed', type=float, default=1, help='Time compression, from 1x to 50x.')
+        parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for a message echo.')
+        parser.add_argument('--baseline', help='Report of an earlier run to compare against.')
+        parser.add_argument('--save-baseline', help='Write this run\'s report to a file.')
+        parser.add_argument('--in-memory-layer', action='store_true',
+                            help='Use an in-memory channel layer instead of the configured one. Events are then '
+                                 'published on the replay\'s event loop rather than by the outbox publisher thread.')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['speed'] <= 50:
+            raise CommandError('--speed must be between 1 and 50.')
+        from config.asgi import application
+        if isinstance(application, TrafficRecorder):
+            application = application.app
+
+        events = load_recording(options['recording'])
+        connections = defaultdict(list)
+        for event in events:
+            if 'c' in event:
+                connections[event['c']].append(event)
+
+        in_memory = options['in_memory_layer']
+        # A file-backed test database, unlike SQLite's shared in-memory one, takes writes from the request
+        # threads, the socket thread and the outbox publisher thread at once, as a real deployment does
+        with tempfile.TemporaryDirectory() as directory, isolated_environment(
+            database=os.path.join(directory, 'replay.sqlite3'),
+            channel_layers=IN_MEMORY_CHANNEL_LAYERS if in_memory else None,
+        ):
+            if not in_memory:
+                self.check_channel_layer()
+            seed = self.seed(events, connections)
+            # The in-memory layer only delivers to sockets on the loop that sent the event
+            with mock.patch.object(publisher, 'schedule') if in_memory else nullcontext():
+                report = async_to_sync(self.replay)(application, events, connections, seed, options)
+
+        report['speed'] = options['speed']
+        report['recording'] = options['recording']
+        report['in_memory_layer'] = in_memory
+        self.print_report(report, options['baseline'])
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf8') as baseline:
+                json.dump(report, baseline, indent=2)
+
+    def check_channel_layer(self):
+        try:
+            async_to_sync(get_channel_layer().group_send)('replay', {'type': 'replay.check'})
+        except Exception as e:
+            raise CommandError(f'The channel layer is unreachable ({e}); start it or pass --in-memory-layer.')
+
+    def seed(self, events, connections):
+        """Create the rooms and users the recording refers to; one user per socket plus one for REST calls."""
+        links = set()
+        room_ids = set()
+        for event in events:
+            if event['e'] == 'open' and event['r'] == 'room':
+                links.add(event['l'])
+            elif event['e'] == 'in' and 'rm' in event:
+                room_ids.add(event['rm'])
+            elif event['e'] == 'http':
+                links.update(self.http_room_links(event))
+
+        rooms = ChatRoom.objects.bulk_create(
+            [ChatRoom(name=link, link=link) for link in sorted(links)]
+            + [ChatRoom(name=f'Room {room_id}', link=f'replay_{room_id}') for room_id in sorted(room_ids)]
+        )
+        by_link = {room.link: room for room in rooms}
+        by_id = {room_id: by_link[f'replay_{room_id}'] for room_id in room_ids}
+
+        users = User.objects.bulk_create(
+            [User(username=f'replay{i}') for i in range(len(connections) + 1)]
+        )
+        rest_user, socket_users = users[0], dict(zip(connections, users[1:]))
+
+        memberships = [RoomMembership(user=rest_user, room=room) for room in rooms]
+        for connection, connection_events in connections.items():
+            opened = connection_events[0]
+            user = socket_users[connection]
+            if opened.get('r') == 'room':
+                memberships.append(RoomMembership(user=user, room=by_link[opened['l']]))
+            elif opened.get('r') == 'user':
+                used = {event['rm'] for event in connection_events if 'rm' in event}
+                memberships += [RoomMembership(user=user, room=by_id[room_id]) for room_id in used]
+        RoomMembership.objects.bulk_create(memberships, ignore_conflicts=True)
+
+        return {
+            'rooms': rooms,
+            'by_link': by_link,
+            'by_id': by_id,
+            'users': users,
+            'rest_user': rest_user,
+            'socket_users': socket_users,
+            'tokens': {user.pk: str(AccessToken.for_user(user)) for user in users},
+        }
+
+    def http_room_links(self, event):
+        links = set()
+        if event.get('q', {}).get('room_link'):
+            links.add(event['q']['room_link'])
+        try:
+            link = resolve(event['p']).kwargs.get('room_link')
+        except Resolver404:
+            link = None
+        if link:
+            links.add(link)
+        return links
+
+    async def replay(self, application, events, connections, seed, options):
+        loop = asyncio.get_running_loop()
+        speed = options['speed']
+        latencies = defaultdict(list)
+        counts = Counter()
+        lag = []
+        message_ids = itertools.count(1)
+        post_rooms = itertools.cycle(seed['rooms'])
+
+        # With the in-memory layer, publish on this loop so events reach the sockets listening on it
+        wakeup = asyncio.Event()
+        if options['in_memory_layer']:
+            publisher.schedule.side_effect = lambda: loop.call_soon_threadsafe(wakeup.set)
+
+        async def publish():
+            while True:
+                await wakeup.wait()
+                await asyncio.sleep(OUTBOX_WINDOW_MS / 1000)
+                wakeup.clear()
+                await database_sync_to_async(publish_outbox)()
+
+        start = loop.time()
+
+        async def at(offset):
+            delay = start + offset / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag.append(-delay)
+
+        def headers(user):
+            return [(b'host', b'localhost'), (b'authorization', f"Bearer {seed['tokens'][user.pk]}".encode())]
+
+        async def run_socket(connection, connection_events):
+            opened = connection_events[0]
+            if opened['e'] != 'open' or 's' in opened:
+                counts['sockets skipped'] += 1
+                return
+            user = seed['socket_users'][connection]
+            if opened['r'] == 'user':
+                path = '/ws/user/'
+            elif opened['r'] == 'direct':
+                other = seed['users'][(seed['users'].index(user) + 1) % len(seed['users'])]
+                path = f'/ws/chat/d/{other.username}/'
+            else:
+                path = f"/ws/chat/{opened['l']}/"
+            query = {key: value for key, value in opened.get('q', {}).items() if value is not None}
+            if query:
+                path += '?' + urlencode(query)
+
+            await at(opened['t'])
+            communicator = WebsocketCommunicator(application, path, headers=headers(user))
+            sent_at = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=options['timeout'])
+            if not connected:
+                counts['connect failed'] += 1
+                return
+            latencies['connect'].append(time.perf_counter() - sent_at)
+
+            pending = {}
+
+            async def read():
+                while True:
+                    message = await communicator.output_queue.get()
+                    for content in frame_messages(message):
+                        match = TOKEN.match(content or '')
+                        if match and match.group(1) in pending:
+                            sent, echoed = pending.pop(match.group(1))
+                            latencies['message'].append(time.perf_counter() - sent)
+                            echoed.set_result(None)
+
+            reader = asyncio.ensure_future(read())
+            echoes = []
+            for event in connection_events[1:]:
+                if event['e'] == 'close':
+                    await at(event['t'])
+                    break
+                if event['e'] != 'in':
+                    continue
+                if event.get('a') not in (None, 'send') or (opened['r'] == 'user' and 'rm' not in event):
+                    counts['frames skipped'] += 1
+                    continue
+                await at(event['t'])
+                token = str(next(message_ids))
+                frame = {'message': f'~{token}~'}
+                if opened['r'] == 'user':
+                    frame.update(action='send', room=seed['by_id'][event['rm']].id)
+                # Pad to the recorded frame size
+                frame['message'] += 'x' * max(0, event['n'] - len(json.dumps(frame)))
+                echoed = loop.create_future()
+                echoes.append(echoed)
+                pending[token] = (time.perf_counter(), echoed)
+                await communicator.send_to(text_data=json.dumps(frame))
+
+            if echoes:
+                done, not_done = await asyncio.wait(echoes, timeout=options['timeout'])
+                counts['messages lost'] += len(not_done)
+            reader.cancel()
+            await communicator.disconnect()
+
+        async def run_http(event):
+            method = event['m']
+            if method not in ('GET', 'HEAD') and not (method == 'POST' and event['p'] == '/chat/messages/'):
+                counts['requests skipped'] += 1
+                return
+            path = event['p']
+            query = {key: value for key, value in event.get('q', {}).items() if value is not None}
+            body = b''
+            request_headers = headers(seed['rest_user'])
+            if method == 'POST':
+                if not seed['rooms']:
+                    counts['requests skipped'] += 1
+                    return
+                payload = {'room': next(post_rooms).id, 'message_type': 'TEXT', 'content': ''}
+                payload['content'] = 'x' * max(1, event['n'] - len(json.dumps(payload)))
+                body = json.dumps(payload).encode()
+                request_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+
+            await at(event['t'])
+            communicator = HttpCommunicator(
+                application, method, path + ('?' + urlencode(query) if query else ''), body=body,
+                headers=request_headers,
+            )
+            sent_at = time.perf_counter()
+            response = await communicator.get_response(timeout=options['timeout'])
+            latencies['http'].append(time.perf_counter() - sent_at)
+            counts[f"http {response['status']}"] += 1
+
+        publishing = asyncio.ensure_future(publish()) if options['in_memory_layer'] else None
+        wall_start = time.perf_counter()
+        await asyncio.gather(
+            *(run_socket(connection, connection_events) for connection, connection_events in connections.items()),
+            *(run_http(event) for event in events if event['e'] == 'http'),
+        )
+        wall = time.perf_counter() - wall_start
+        if publishing is not None:
+            publishing.cancel()
+
+        return {
+            'wall_s': wall,
+            'recorded_s': events[-1]['t'],
+            'max_lag_ms': max(lag, default=0) * 1000,
+            'counts': dict(counts),
+            'categories': {
+                name: {**summarize(values), 'throughput': len(values) / wall}
+                for name, values in latencies.items() if values
+            },
+        }
+
+    def print_report(self, report, baseline_path):
+        baseline = None
+        if baseline_path:
+            with open(baseline_path, encoding='utf8') as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('in_memory_layer') != report['in_memory_layer']:
+                self.stdout.write(self.style.WARNING('The baseline was recorded with a different channel layer.'))
+
+        self.stdout.write(f"replayed {report['recorded_s']:.1f} s of traffic at {report['speed']:g}x "
+                          f"in {report['wall_s']:.1f} s, max schedule lag {report['max_lag_ms']:.1f} ms")
+        for name, count in sorted(report['counts'].items()):
+            self.stdout.write(f'  {name}: {count}')
+        self.stdout.write(f"{'category':<10} {'count':>7} {'ops/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for name, summary in sorted(report['categories'].items()):
+            line = (f"{name:<10} {summary['count']:>7} {summary['throughput']:>9.1f} "
+                    f"{summary['p50_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+            previous = (baseline or {}).get('categories', {}).get(name)
+            if previous:
+                line += '  vs baseline: ' + '  '.join(
+                    f"{label} {self.change(summary[key], previous[key])}"
+                    for label, key in (('ops/s', 'throughput'), ('p50', 'p50_ms'), ('p99', 'p99_ms'))
+                )
+            self.stdout.write(line)
+
+    def change(self, value, previous):
+        if not previous:
+            return 'n/a'
+        return f'{(value - previous) / previous * 100:+.1f}%'
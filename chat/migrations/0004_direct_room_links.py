@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:20
+
+import hashlib
+from django.db import migrations
+
+
+def rekey_direct_rooms(apps, schema_editor):
+    """Replace username based ``link_<a>_<b>`` links with the hashed user pair key."""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+    for room in ChatRoom.objects.filter(room_type='DIRECT'):
+        user_ids = sorted(RoomMembership.objects.filter(room=room).values_list('user_id', flat=True))
+        if len(user_ids) != 2:
+            continue
+        link = 'dm_' + hashlib.sha256(f'{user_ids[0]}:{user_ids[1]}'.encode()).hexdigest()[:17]
+        if not ChatRoom.objects.filter(link=link).exists():
+            ChatRoom.objects.filter(pk=room.pk).update(link=link)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_outboxevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(rekey_direct_rooms, migrations.RunPython.noop),
+    ]
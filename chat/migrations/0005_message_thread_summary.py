@@ -0,0 +1,42 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:21
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def populate_thread_summary(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    threads = Message.objects.filter(parent__isnull=False).values('parent').annotate(
+        reply_count=Count('id'), last_reply_at=Max('timestamp'),
+    )
+    for thread in threads:
+        Message.objects.filter(pk=thread['parent']).update(
+            reply_count=thread['reply_count'], last_reply_at=thread['last_reply_at'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_direct_room_links'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='last_reply_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['parent', 'timestamp'], name='chat_messag_parent__4374db_idx'),
+        ),
+        migrations.RunPython(populate_thread_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_message_thread_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='moderation_policy',
+            field=models.CharField(choices=[('OFF', 'Off'), ('REJECT', 'Reject'), ('MASK', 'Mask'), ('FLAG', 'Flag')], default='MASK', max_length=6),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='is_flagged',
+            field=models.BooleanField(default=False),
+        ),
+    ]
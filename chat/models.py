@@ -1,8 +1,13 @@
+import hashlib
 import random
 import string
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
 
+# Attempts at a random link before giving up; 13 random characters practically never collide
+LINK_ATTEMPTS = 5
+
+
 class ChatRoom(models.Model):
     """Model representing a chat room."""
     ROOM_TYPES = (
@@ -10,29 +15,67 @@ class ChatRoom(models.Model):
         ('PRIVATE', 'Private'),
         ('DIRECT', 'Direct'),
     )
+    MODERATION_POLICIES = (
+        ('OFF', 'Off'),
+        ('REJECT', 'Reject'),
+        ('MASK', 'Mask'),
+        ('FLAG', 'Flag'),
+    )
 
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True, null=True)
     room_type = models.CharField(max_length=7, choices=ROOM_TYPES, default='PUBLIC')
     link = models.CharField(max_length=20, unique=True)
+    moderation_policy = models.CharField(max_length=6, choices=MODERATION_POLICIES, default='MASK')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
+        # Link uniqueness is left to the unique constraint rather than checked up front
         if self.room_type == 'PRIVATE' and not self.link:
-            self.link = self.generate_random_link()
-            while ChatRoom.objects.filter(link=self.link).exists():
+            for attempt in range(LINK_ATTEMPTS):
                 self.link = self.generate_random_link()
-        elif self.room_type == 'PUBLIC' and self.link:
+                try:
+                    with transaction.atomic():
+                        return super().save(*args, **kwargs)
+                except IntegrityError:
+                    if attempt == LINK_ATTEMPTS - 1:
+                        raise
+        if self.room_type == 'PUBLIC' and self.link:
             if not self.is_valid_link_format(self.link):
                 raise ValueError("The provided link format is invalid.")
-            if ChatRoom.objects.filter(link=self.link).exists():
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
                 raise ValueError("The provided link is already in use.")
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Room: {self.name} ({self.get_room_type_display()})'
 
+    def is_visible_to(self, user):
+        """Public rooms are visible to everyone, other rooms only to their members."""
+        return self.room_type == 'PUBLIC' or self.has_member(user)
+
+    def has_member(self, user):
+        return self.memberships.filter(user=user).exists()
+
+    def is_administered_by(self, user):
+        """Staff and the room's admins may manage its members."""
+        return user.is_staff or self.memberships.filter(user=user, role='ADMIN').exists()
+
+    @property
+    def group_name(self):
+        """Channel layer group that live sockets of this room are subscribed to."""
+        return f'chat_{self.link}'
+
+    @staticmethod
+    def direct_link(user_id, other_user_id):
+        """Deterministic link of the direct room between two users, compact enough for ``link``."""
+        low, high = sorted((user_id, other_user_id))
+        return 'dm_' + hashlib.sha256(f'{low}:{high}'.encode()).hexdigest()[:17]
+
     def generate_random_link(self):
         """Generate a random link for private rooms."""
         letters_and_digits = string.ascii_letters + string.digits
@@ -76,12 +119,57 @@ class Message(models.Model):
     message_type = models.CharField(max_length=5, choices=MESSAGE_TYPES, default='TEXT')
     file = models.FileField(upload_to='chat_files/', blank=True, null=True)
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='replies')
+    # Denormalized thread summary, maintained when replies are written or deleted
+    reply_count = models.PositiveIntegerField(default=0)
+    last_reply_at = models.DateTimeField(blank=True, null=True)
+    is_flagged = models.BooleanField(default=False)
+    # Deleted messages stay behind as tombstones so that clients syncing changes learn about them
+    is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(blank=True, null=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['timestamp']  # Order messages by timestamp by default
+        indexes = [
+            models.Index(fields=['parent', 'timestamp']),
+            models.Index(fields=['room', 'updated_at']),
+        ]
 
     def __str__(self):
         return f'Message by {self.user.username} in {self.room.name} at {self.timestamp}'
 
+
+class OutboxEvent(models.Model):
+    """Channel layer event persisted with its message and published to live sockets after commit."""
+    group = models.CharField(max_length=100)
+    payload = models.JSONField()
+    claim = models.CharField(max_length=32, blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [models.Index(fields=['claim'])]
+
+    def __str__(self):
+        return f'Event for {self.group} at {self.created_at}'
+
+
+class PendingNotification(models.Model):
+    """Messages a member missed in a room while offline, coalesced into one row per user and room."""
+    PREVIEW_LENGTH = 100
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='pending_notifications')
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='pending_notifications')
+    count = models.PositiveIntegerField(default=0)
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_message = models.ForeignKey(Message, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'room')
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.count} missed in {self.room_id} for {self.user_id}'
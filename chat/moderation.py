@@ -0,0 +1,169 @@
+"""
+Content moderation of incoming messages.
+
+Prohibited terms are read from ``CHAT_MODERATION_TERMS_FILE`` (one term per
+line, ``#`` starts a comment) and compiled into a single Aho-Corasick
+automaton, so screening a message costs one pass over its text regardless
+of how many terms there are. The file is checked for changes at most every
+``CHAT_MODERATION_RELOAD_INTERVAL`` seconds and recompiled without a restart.
+
+Each room's ``moderation_policy`` decides what happens to a match: REJECT
+refuses the message, MASK replaces the matched terms with asterisks and
+FLAG stores the message marked for review.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from .models import ChatRoom
+
+logger = logging.getLogger(__name__)
+
+TERMS_FILE = getattr(settings, 'CHAT_MODERATION_TERMS_FILE', None)
+RELOAD_INTERVAL = getattr(settings, 'CHAT_MODERATION_RELOAD_INTERVAL', 5)
+POLICY_CACHE_TIMEOUT = getattr(settings, 'CHAT_MODERATION_POLICY_CACHE_TIMEOUT', 30)
+
+
+class TermMatcher:
+    """Aho-Corasick automaton matching whole-word occurrences of many terms at once."""
+
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [()]
+
+        for term in terms:
+            term = term.strip().lower()
+            if not term:
+                continue
+            node = 0
+            for char in term:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(())
+                node = next_node
+            self.outputs[node] = (*self.outputs[node], len(term))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def find(self, text):
+        """Return the ``(start, end)`` spans of whole-word matches in ``text``."""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # Keep offsets aligned when lowercasing changes the length of a character
+            lowered = ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        spans = []
+        node = 0
+        for index, char in enumerate(lowered):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for length in outputs[node]:
+                start, end = index - length + 1, index + 1
+                if (start == 0 or not lowered[start - 1].isalnum()) and (end == len(lowered) or not lowered[end].isalnum()):
+                    spans.append((start, end))
+        return spans
+
+
+def mask(text, spans):
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = '*' * (end - start)
+    return ''.join(chars)
+
+
+class Moderator:
+    """Holds the compiled term list and swaps in a new one when the file changes."""
+
+    def __init__(self, path=TERMS_FILE, reload_interval=RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.matcher = TermMatcher([])
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get_matcher(self):
+        now = time.monotonic()
+        if self.path and now - self._checked_at >= self.reload_interval:
+            with self._lock:
+                if now - self._checked_at >= self.reload_interval:
+                    self._checked_at = now
+                    self.reload()
+        return self.matcher
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, encoding='utf8') as terms_file:
+            terms = [line for line in terms_file if line.strip() and not line.lstrip().startswith('#')]
+        self.matcher = TermMatcher(terms)
+        self._mtime = mtime
+        logger.info(f"Loaded {len(terms)} moderation terms from {self.path}")
+
+
+moderator = Moderator()
+_room_policies = {}
+
+
+def get_room_policy(room_id):
+    """Moderation policy of a room, cached in-process for a short while."""
+    cached = _room_policies.get(room_id)
+    if cached is not None and cached[1] > time.monotonic():
+        return cached[0]
+    policy = ChatRoom.objects.filter(pk=room_id).values_list('moderation_policy', flat=True).first()
+    _room_policies[room_id] = (policy, time.monotonic() + POLICY_CACHE_TIMEOUT)
+    return policy
+
+
+def forget_room_policy(room_id):
+    _room_policies.pop(room_id, None)
+
+
+def moderate(room_id, content):
+    """
+    Apply the room's policy to a message's content.
+
+    Returns the content to store and whether the message is flagged; raises
+    ``ValidationError`` when the policy rejects it.
+    """
+    if not content:
+        return content, False
+    spans = moderator.get_matcher().find(content)
+    if not spans:
+        return content, False
+
+    policy = get_room_policy(room_id)
+    if policy == 'REJECT':
+        raise ValidationError("Message contains prohibited content.")
+    if policy == 'MASK':
+        return mask(content, spans), False
+    if policy == 'FLAG':
+        return content, True
+    return content, False
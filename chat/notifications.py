@@ -0,0 +1,163 @@
+"""
+Offline notification queue.
+
+Once a message has been published, every member of the room without a
+socket open on it gets a ``PendingNotification`` counting the messages they
+missed there, with a preview of the latest one. Entries are coalesced
+per user and room, so the queue is bounded by memberships rather than by
+message volume.
+
+Entries leave the queue either as one digest frame when the user next
+connects, or in batches through the push sink named by ``CHAT_PUSH_SINK``
+(see the ``deliver_notifications`` command). Entries updated after they were
+read are left for the next delivery, so a notification may be repeated but
+is never lost.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Case, CharField, F, IntegerField, Value, When
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Message, PendingNotification, RoomMembership
+from .presence import online_members
+
+logger = logging.getLogger(__name__)
+
+PUSH_SINK = getattr(settings, 'CHAT_PUSH_SINK', 'chat.notifications.LoggingPushSink')
+PUSH_BATCH_SIZE = getattr(settings, 'CHAT_PUSH_BATCH_SIZE', 500)
+
+NOTIFICATION_FIELDS = ('id', 'user_id', 'room_id', 'room__link', 'count', 'preview', 'last_message_id', 'updated_at')
+
+
+def queue_notifications(message_ids):
+    """
+    Count top-level messages against their rooms' offline members. Called by
+    the outbox publisher once the messages were published, outside the
+    transactions that saved them. Returns how many entries were bumped.
+
+    Memberships and presence of all the rooms are read at once, and entries
+    are created and bumped ``PUSH_BATCH_SIZE`` at a time across rooms, so a
+    broadcast to many rooms costs a few statements per batch rather than per
+    room. Messages of one room count together.
+    """
+    by_room = defaultdict(list)
+    for message in Message.objects.filter(pk__in=message_ids, parent__isnull=True, is_deleted=False).order_by('id'):
+        by_room[message.room_id].append(message)
+    if not by_room:
+        return 0
+
+    members = defaultdict(list)
+    for room_id, user_id in RoomMembership.objects.filter(room_id__in=by_room).values_list('room_id', 'user_id'):
+        members[room_id].append(user_id)
+    online = online_members(members)
+
+    entries = []
+    for room_id, room_messages in by_room.items():
+        # Senders do not get their own messages counted
+        sent = Counter(message.user_id for message in room_messages)
+        entries += [
+            (room_id, user_id, len(room_messages) - sent[user_id]) for user_id in members[room_id]
+            if user_id not in online[room_id] and len(room_messages) > sent[user_id]
+        ]
+    latest = {room_id: room_messages[-1] for room_id, room_messages in by_room.items()}
+    previews = {
+        room_id: (last.content or last.get_message_type_display())[:PendingNotification.PREVIEW_LENGTH]
+        for room_id, last in latest.items()
+    }
+
+    for start in range(0, len(entries), PUSH_BATCH_SIZE):
+        batch = entries[start:start + PUSH_BATCH_SIZE]
+        rooms = {room_id for room_id, user_id, count in batch}
+        # Create the missing rows, then bump every row of the batch in one statement
+        PendingNotification.objects.bulk_create(
+            [PendingNotification(user_id=user_id, room_id=room_id) for room_id, user_id, count in batch],
+            ignore_conflicts=True,
+        )
+        pks = {
+            (room_id, user_id): pk for pk, room_id, user_id
+            in PendingNotification.objects.filter(room_id__in=rooms).values_list('id', 'room_id', 'user_id')
+        }
+        by_count = defaultdict(list)
+        for room_id, user_id, count in batch:
+            # Missing if delivered since it was created, like a row deleted before an update
+            if (room_id, user_id) in pks:
+                by_count[count].append(pks[room_id, user_id])
+        PendingNotification.objects.filter(pk__in=[pk for ids in by_count.values() for pk in ids]).update(
+            count=F('count') + Case(
+                *(When(pk__in=ids, then=Value(count)) for count, ids in by_count.items()),
+                default=Value(0), output_field=IntegerField(),
+            ),
+            preview=Case(
+                *(When(room_id=room_id, then=Value(previews[room_id])) for room_id in rooms),
+                output_field=CharField(),
+            ),
+            last_message=Case(
+                *(When(room_id=room_id, then=Value(latest[room_id].pk)) for room_id in rooms),
+                output_field=IntegerField(),
+            ),
+            updated_at=timezone.now(),
+        )
+    return len(entries)
+
+
+def notification_payload(entry):
+    return {
+        'room': entry['room_id'],
+        'link': entry['room__link'],
+        'count': entry['count'],
+        'preview': entry['preview'],
+        'id': entry['last_message_id'],
+        'timestamp': entry['updated_at'].isoformat(),
+    }
+
+
+def take_digest(user_id):
+    """Remove and return the user's pending notifications, most recent first."""
+    taken_at = timezone.now()
+    entries = list(
+        PendingNotification.objects.filter(user_id=user_id).order_by('-updated_at').values(*NOTIFICATION_FIELDS)
+    )
+    if entries:
+        PendingNotification.objects.filter(
+            pk__in=[entry['id'] for entry in entries], updated_at__lte=taken_at,
+        ).delete()
+    return [notification_payload(entry) for entry in entries]
+
+
+class LoggingPushSink:
+    """Default push sink, logging what a push service would be asked to deliver."""
+
+    def send(self, notifications):
+        for notification in notifications:
+            logger.info(f"Push to user {notification['user']}: {notification['count']} new messages "
+                        f"in {notification['link']}")
+
+
+def get_push_sink():
+    return import_string(PUSH_SINK)()
+
+
+def deliver_pending(sink=None, min_age=0, batch_size=PUSH_BATCH_SIZE):
+    """
+    Hand entries idle for at least ``min_age`` seconds to the push sink in
+    batches of ``batch_size`` and remove them. Returns how many were delivered.
+    """
+    sink = sink or get_push_sink()
+    taken_at = timezone.now() - timedelta(seconds=min_age)
+    delivered, last_id = 0, 0
+    while True:
+        entries = list(
+            PendingNotification.objects.filter(pk__gt=last_id, updated_at__lte=taken_at)
+            .order_by('id').values(*NOTIFICATION_FIELDS)[:batch_size]
+        )
+        if not entries:
+            return delivered
+        sink.send([{'user': entry['user_id'], **notification_payload(entry)} for entry in entries])
+        PendingNotification.objects.filter(
+            pk__in=[entry['id'] for entry in entries], updated_at__lte=taken_at,
+        ).delete()
+        delivered += len(entries)
+        last_id = entries[-1]['id']
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import OutboxEvent
+from .notifications import queue_notifications
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = getattr(settings, 'CHAT_OUTBOX_BATCH_SIZE', 500)
+OUTBOX_WINDOW_MS = getattr(settings, 'CHAT_OUTBOX_WINDOW_MS', 5)
+
+
+def chunked(values, size=OUTBOX_BATCH_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+async def send_to_group(channel_layer, group, events):
+    for event in events:
+        await channel_layer.group_send(group, event)
+
+
+async def group_send_many(events, batch_size=OUTBOX_BATCH_SIZE, progress=None):
+    """
+    Send ``(group, event)`` pairs to the channel layer.
+
+    Groups of one batch are sent to concurrently so they are pipelined over
+    the layer's connection pool instead of waiting on a round trip each.
+    Events of the same group are sent one after another, in the given order,
+    since concurrent sends to one group may be delivered in any order.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return 0
+
+    total = len(events)
+    sent = 0
+    for start in range(0, total, batch_size):
+        batch = events[start:start + batch_size]
+        by_group = defaultdict(list)
+        for group, event in batch:
+            by_group[group].append(event)
+        await asyncio.gather(*(
+            send_to_group(channel_layer, group, group_events) for group, group_events in by_group.items()
+        ))
+        sent += len(batch)
+        if progress:
+            progress(sent, total)
+    return sent
+
+
+def publish_outbox(ids=None, batch_size=OUTBOX_BATCH_SIZE, progress=None):
+    """
+    Publish pending outbox events to the channel layer and delete them.
+
+    Every batch is first claimed with a unique token so concurrent publishers
+    never send the same event twice. Top-level chat messages of the batch are
+    then queued for their rooms' offline members. Returns the number of
+    published events.
+    """
+    pending = OutboxEvent.objects.filter(claim__isnull=True)
+    if ids is not None:
+        pending = pending.filter(id__in=ids)
+    total = len(ids) if ids is not None else None
+    published = 0
+
+    while True:
+        batch_ids = list(pending.values_list('id', flat=True)[:batch_size])
+        if not batch_ids:
+            return published
+
+        token = uuid.uuid4().hex
+        OutboxEvent.objects.filter(id__in=batch_ids, claim__isnull=True).update(claim=token, claimed_at=timezone.now())
+        claimed = OutboxEvent.objects.filter(claim=token)
+        events = [(group, payload) for group, payload in claimed.values_list('group', 'payload')]
+        try:
+            async_to_sync(group_send_many)(events, batch_size=batch_size)
+        except Exception:
+            claimed.update(claim=None, claimed_at=None)
+            raise
+        claimed.delete()
+        queue_notifications([
+            payload['id'] for group, payload in events
+            if payload.get('type') == 'chat_message' and payload.get('parent') is None
+        ])
+
+        published += len(events)
+        if progress:
+            progress(published, total or published)
+
+
+def release_stale_claims(max_age):
+    """Make events claimed by a publisher that died mid-batch publishable again."""
+    cutoff = timezone.now() - timedelta(seconds=max_age)
+    return OutboxEvent.objects.filter(claim__isnull=False, claimed_at__lt=cutoff).update(claim=None, claimed_at=None)
+
+
+class OutboxPublisher:
+    """
+    Background publisher draining the outbox shortly after commits.
+
+    Wake-ups arriving within the batching window are coalesced so that bursts
+    of messages are published together.
+    """
+
+    def __init__(self, window_ms=OUTBOX_WINDOW_MS):
+        self.window = window_ms / 1000
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-outbox', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.window)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                publish_outbox()
+            except Exception as e:
+                logger.error(f"Error publishing outbox events: {e}")
+
+
+publisher = OutboxPublisher()
@@ -0,0 +1,93 @@
+"""
+Which users currently have a socket open, and on which rooms.
+
+Sockets are counted per user in the cache: a multiplexed socket counts for
+all of the user's rooms, a room or direct socket for its own room only. A
+user with several tabs or devices stays online until the last one
+disconnects. The cache has to be shared between worker processes for this
+to hold across them.
+
+Counters expire after ``CHAT_PRESENCE_TIMEOUT`` seconds so that sockets lost
+with a crashed process do not keep their user online for ever; open sockets
+refresh them every third of that.
+"""
+
+import asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+PRESENCE_TIMEOUT = getattr(settings, 'CHAT_PRESENCE_TIMEOUT', 3600)
+PRESENCE_HEARTBEAT = PRESENCE_TIMEOUT / 3
+
+
+def presence_key(user_id, room_id=None):
+    if room_id is None:
+        return f'chat:online:{user_id}'
+    return f'chat:online:{user_id}:{room_id}'
+
+
+def mark_online(user_id, room_id=None):
+    key = presence_key(user_id, room_id)
+    cache.add(key, 0, PRESENCE_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.set(key, 1, PRESENCE_TIMEOUT)
+
+
+def refresh_online(user_id, room_id=None):
+    """Push back the expiry of a user whose socket is still open."""
+    key = presence_key(user_id, room_id)
+    if not cache.touch(key, PRESENCE_TIMEOUT):
+        # Expired or dropped by another socket's disconnect while this one stayed open
+        cache.add(key, 1, PRESENCE_TIMEOUT)
+
+
+def mark_offline(user_id, room_id=None):
+    key = presence_key(user_id, room_id)
+    try:
+        if cache.decr(key) <= 0:
+            cache.delete(key)
+    except ValueError:
+        pass
+
+
+def online_members(members):
+    """
+    Which of each room's members have at least one socket open on it, for
+    ``{room_id: user_ids}``, in a single cache read.
+    """
+    keys = {presence_key(user_id) for user_ids in members.values() for user_id in user_ids}
+    keys.update(presence_key(user_id, room_id) for room_id, user_ids in members.items() for user_id in user_ids)
+    counts = cache.get_many(list(keys))
+    return {
+        room_id: {
+            user_id for user_id in user_ids
+            if counts.get(presence_key(user_id), 0) > 0 or counts.get(presence_key(user_id, room_id), 0) > 0
+        }
+        for room_id, user_ids in members.items()
+    }
+
+
+class PresenceMixin:
+    """Consumer mixin keeping the socket's user online while the socket is open."""
+
+    async def go_online(self, room_id=None):
+        """Count the socket for ``room_id``, or for all of the user's rooms when None."""
+        self.presence = (self.scope['user'].pk, room_id)
+        await sync_to_async(mark_online)(*self.presence)
+        self._heartbeat = asyncio.ensure_future(self._keep_online())
+
+    async def _keep_online(self):
+        while True:
+            await asyncio.sleep(PRESENCE_HEARTBEAT)
+            await sync_to_async(refresh_online)(*self.presence)
+
+    async def go_offline(self):
+        if getattr(self, '_heartbeat', None) is None:
+            return
+        self._heartbeat.cancel()
+        self._heartbeat = None
+        await sync_to_async(mark_offline)(*self.presence)
@@ -0,0 +1,167 @@
+"""
+Recording of live traffic shapes for local replay (see ``replay_traffic``).
+
+``TrafficRecorder`` wraps the ASGI application when ``CHAT_TRAFFIC_RECORD_FILE``
+is set and appends one compact JSON line per event: REST calls, WebSocket
+connects, frames in both directions and closes. Lines carry timing, route,
+room and size, never message content, tokens or usernames.
+
+Each process starts its own segment with a header line
+``{"v": 1, "pid": ..., "start": <epoch>}``; event offsets ``t`` are seconds
+since that start and connection ids ``c`` are local to the segment. Lines
+are written in whole-line chunks to a file opened for appending, so several
+workers can share one file.
+"""
+
+import atexit
+import itertools
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+# Query parameters whose values are recorded; only the names of the others are kept
+RECORDED_QUERY_VALUES = ('room_link', 'schema', 'compress', 'projection', 'format', 'page_size', 'compression', 'batch')
+FLUSH_LINES = 100
+
+
+def encode_line(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def recorded_query(scope):
+    params = parse_qs(scope.get('query_string', b'').decode())
+    return {
+        key: values[0] if key in RECORDED_QUERY_VALUES else None
+        for key, values in sorted(params.items()) if key != 'resume'
+    }
+
+
+def websocket_route(scope):
+    """Route of a socket without personal data: ``user``, ``room`` with its link, or ``direct``."""
+    path = scope['path']
+    if path.startswith('/ws/user/'):
+        return {'r': 'user'}
+    if path.startswith('/ws/chat/d/'):
+        return {'r': 'direct'}
+    return {'r': 'room', 'l': path.rstrip('/').rsplit('/', 1)[-1]}
+
+
+def frame_summary(text):
+    """Room id and action of an incoming frame, when it names them."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    summary = {}
+    if isinstance(data.get('room'), int):
+        summary['rm'] = data['room']
+    if isinstance(data.get('action'), str):
+        summary['a'] = data['action'][:32]
+    return summary
+
+
+def frame_size(message):
+    if message.get('bytes') is not None:
+        return len(message['bytes'])
+    return len((message.get('text') or '').encode())
+
+
+class TrafficLog:
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.start = time.time()
+        self.clock = time.monotonic()
+        self.lines = [encode_line({'v': 1, 'pid': os.getpid(), 'start': self.start})]
+        atexit.register(self.flush)
+
+    def offset(self):
+        return round(time.monotonic() - self.clock, 4)
+
+    def write(self, record):
+        self.lines.append(encode_line(record))
+        if len(self.lines) >= FLUSH_LINES:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            os.write(self.fd, ''.join(self.lines).encode())
+            self.lines = []
+
+
+class TrafficRecorder:
+    """ASGI middleware appending the shape of HTTP and WebSocket traffic to a ``TrafficLog``."""
+
+    def __init__(self, app, path):
+        self.app = app
+        self.log = TrafficLog(path)
+        self.connection_ids = itertools.count(1)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            return await self.record_http(scope, receive, send)
+        if scope['type'] == 'websocket':
+            return await self.record_websocket(scope, receive, send)
+        return await self.app(scope, receive, send)
+
+    async def record_http(self, scope, receive, send):
+        record = {'t': self.log.offset(), 'e': 'http', 'm': scope['method'], 'p': scope['path'], 'n': 0, 'o': 0}
+        query = recorded_query(scope)
+        if query:
+            record['q'] = query
+        started = time.monotonic()
+
+        async def counting_receive():
+            message = await receive()
+            if message['type'] == 'http.request':
+                record['n'] += len(message.get('body', b''))
+            return message
+
+        async def counting_send(message):
+            if message['type'] == 'http.response.start':
+                record['s'] = message['status']
+            elif message['type'] == 'http.response.body':
+                record['o'] += len(message.get('body', b''))
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                record['d'] = round((time.monotonic() - started) * 1000, 2)
+                self.log.write(record)
+
+        await self.app(scope, counting_receive, counting_send)
+
+    async def record_websocket(self, scope, receive, send):
+        connection = next(self.connection_ids)
+        opened = {'t': self.log.offset(), 'e': 'open', 'c': connection, **websocket_route(scope)}
+        query = recorded_query(scope)
+        if query:
+            opened['q'] = query
+        started = time.monotonic()
+
+        async def counting_receive():
+            message = await receive()
+            if message['type'] == 'websocket.receive':
+                record = {'t': self.log.offset(), 'e': 'in', 'c': connection, 'n': frame_size(message)}
+                if message.get('text') is not None:
+                    record.update(frame_summary(message['text']))
+                self.log.write(record)
+            elif message['type'] == 'websocket.disconnect':
+                self.log.write({'t': self.log.offset(), 'e': 'close', 'c': connection, 's': message.get('code')})
+            return message
+
+        async def counting_send(message):
+            if message['type'] == 'websocket.accept':
+                opened['d'] = round((time.monotonic() - started) * 1000, 2)
+                self.log.write(opened)
+            elif message['type'] == 'websocket.send':
+                self.log.write({'t': self.log.offset(), 'e': 'out', 'c': connection, 'n': frame_size(message)})
+            elif message['type'] == 'websocket.close':
+                if 'd' not in opened:
+                    # Rejected before being accepted
+                    opened['s'] = message.get('code', 1000)
+                    self.log.write(opened)
+                self.log.write({'t': self.log.offset(), 'e': 'close', 'c': connection, 's': message.get('code', 1000)})
+            await send(message)
+
+        await self.app(scope, counting_receive, counting_send)
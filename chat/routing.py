@@ -1,7 +1,8 @@
 from django.urls import path
-from chat.consumers import ChatRoomConsumer, DirectChatConsumer
+from chat.consumers import ChatRoomConsumer, DirectChatConsumer, UserChatConsumer
 
 websocket_urlpatterns = [
+    path('ws/user/', UserChatConsumer.as_asgi()),
     path('ws/chat/<str:room_link>/', ChatRoomConsumer.as_asgi()),
     path('ws/chat/d/<str:username>/', DirectChatConsumer.as_asgi())
 ]
@@ -1,11 +1,14 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import ChatRoom, RoomMembership, Message
 from user.serializers import AccountSerializer
 
+BULK_MAX_ITEMS = getattr(settings, 'CHAT_BULK_MAX_ITEMS', 10000)
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatRoom
-        fields = ('id', 'name', 'link', 'description', 'room_type', 'created_at', 'updated_at')
+        fields = ('id', 'name', 'link', 'description', 'room_type', 'moderation_policy', 'created_at', 'updated_at')
         read_only_fields = ('created_at', 'updated_at')
 
 class RoomMembershipSerializer(serializers.ModelSerializer):
@@ -19,12 +22,16 @@ class RoomMembershipSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     user = AccountSerializer(read_only=True)
     room = serializers.PrimaryKeyRelatedField(queryset=ChatRoom.objects.all())
-    parent = serializers.PrimaryKeyRelatedField(queryset=Message.objects.all(), required=False, allow_null=True)
+    parent = serializers.PrimaryKeyRelatedField(
+        queryset=Message.objects.filter(is_deleted=False), required=False, allow_null=True
+    )
 
     class Meta:
         model = Message
-        fields = ('id', 'user', 'room', 'content', 'message_type', 'file', 'parent', 'timestamp', 'updated_at')
-        read_only_fields = ('timestamp', 'updated_at')
+        fields = ('id', 'user', 'room', 'content', 'message_type', 'file', 'parent', 'reply_count', 'last_reply_at',
+                  'is_flagged', 'is_deleted', 'deleted_at', 'timestamp', 'updated_at')
+        read_only_fields = ('reply_count', 'last_reply_at', 'is_flagged', 'is_deleted', 'deleted_at', 'timestamp',
+                            'updated_at')
 
     def validate(self, attrs):
         # Ensure content or file is provided based on message type
@@ -34,3 +41,42 @@ class MessageSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Image/File message must contain a file.")
         return attrs
 
+
+class BroadcastMessageSerializer(serializers.Serializer):
+    rooms = serializers.ListField(child=serializers.CharField(max_length=20), required=False, allow_empty=False)
+    room_type = serializers.ChoiceField(choices=('PUBLIC', 'PRIVATE'), required=False)
+    message = serializers.CharField()
+
+    def validate(self, attrs):
+        # Either an explicit list of room links or a whole room type must be targeted
+        if not attrs.get('rooms') and not attrs.get('room_type'):
+            raise serializers.ValidationError("Either rooms or room_type must be provided.")
+        return attrs
+
+
+class RoomSpecSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    link = serializers.CharField(max_length=20, required=False)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    room_type = serializers.ChoiceField(choices=('PUBLIC', 'PRIVATE'), default='PUBLIC')
+    moderation_policy = serializers.ChoiceField(choices=ChatRoom.MODERATION_POLICIES, default='MASK')
+
+    def validate(self, attrs):
+        if attrs['room_type'] == 'PUBLIC' and not attrs.get('link'):
+            raise serializers.ValidationError("Public rooms must have a link.")
+        return attrs
+
+
+class BulkRoomSerializer(serializers.Serializer):
+    rooms = RoomSpecSerializer(many=True, allow_empty=False, max_length=BULK_MAX_ITEMS)
+
+    def validate_rooms(self, rooms):
+        links = [room['link'] for room in rooms if room.get('link')]
+        if len(links) != len(set(links)):
+            raise serializers.ValidationError("Links must be unique within the request.")
+        return rooms
+
+
+class RoomMembersSerializer(serializers.Serializer):
+    users = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=BULK_MAX_ITEMS)
+    role = serializers.ChoiceField(choices=RoomMembership.ROLES, default='MEMBER')
@@ -0,0 +1,313 @@
+import logging
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from .caching import invalidate_public_rooms
+from .models import LINK_ATTEMPTS, ChatRoom, Message, OutboxEvent, RoomMembership
+from .moderation import moderate
+from .outbox import OUTBOX_BATCH_SIZE, chunked, publish_outbox, publisher
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+
+def user_group_name(user_id):
+    """Channel layer group of all sockets of one user."""
+    return f'user_{user_id}'
+
+
+def thread_group_name(parent_id):
+    """Channel layer group of the sockets following one reply thread."""
+    return f'thread_{parent_id}'
+
+
+def message_event(message, username):
+    """Channel layer event delivered to ``chat_message`` handlers."""
+    return {
+        'type': 'chat_message',
+        'id': message.id,
+        'room': message.room_id,
+        'parent': message.parent_id,
+        'user': username,
+        'message': message.content,
+        'message_type': message.message_type,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def change_event(event_type, message):
+    """Channel layer event telling live sockets that a message was edited or deleted."""
+    event = {
+        'type': event_type,
+        'id': message.id,
+        'room': message.room_id,
+        'parent': message.parent_id,
+        'updated_at': message.updated_at.isoformat(),
+    }
+    if not message.is_deleted:
+        event['message'] = message.content
+    return event
+
+
+def event_group(message):
+    """Group a message's events go to: its thread for replies, otherwise its room."""
+    if message.parent_id is not None:
+        return thread_group_name(message.parent_id)
+    return message.room.group_name
+
+
+def validate_message(content, message_type, file=None, room=None, parent=None):
+    if parent is not None and parent.room_id != room.id:
+        raise ValidationError("Parent message belongs to another room.")
+    if message_type not in dict(Message.MESSAGE_TYPES):
+        raise ValidationError(f"Unknown message type: {message_type}.")
+    if message_type == 'TEXT' and not content:
+        raise ValidationError("Text message must contain content.")
+    if message_type in ['IMAGE', 'FILE'] and not file:
+        raise ValidationError("Image/File message must contain a file.")
+
+
+def ingest_message(user, room, content=None, message_type='TEXT', file=None, parent=None):
+    """
+    Single entry point for new messages coming from REST and WebSocket clients.
+
+    The message and its outbox event are written in one transaction; the
+    event is published to the room's live sockets after commit. Message ids
+    are the ordering clients should rely on.
+
+    Replies update their parent's thread summary and are only published to
+    the thread's subscribers. Top-level messages are queued for the room's
+    offline members when published.
+    """
+    validate_message(content, message_type, file, room, parent)
+    content, is_flagged = moderate(room.id, content)
+    with transaction.atomic():
+        message = Message.objects.create(
+            user=user,
+            room=room,
+            content=content,
+            message_type=message_type,
+            file=file,
+            parent=parent,
+            is_flagged=is_flagged,
+        )
+        if parent is None:
+            group = room.group_name
+        else:
+            group = thread_group_name(parent.pk)
+            Message.objects.filter(pk=parent.pk).update(
+                reply_count=F('reply_count') + 1, last_reply_at=message.timestamp, updated_at=message.timestamp,
+            )
+        OutboxEvent.objects.create(group=group, payload=message_event(message, user.username))
+        transaction.on_commit(publisher.schedule)
+    return message
+
+
+def get_parent_message(room, parent_id):
+    """Look up the message a WebSocket client replies to, or None for top-level messages."""
+    if parent_id is None:
+        return None
+    parent = Message.objects.filter(pk=parent_id, room=room, is_deleted=False).only('id', 'room_id').first()
+    if parent is None:
+        raise ValidationError("Parent message does not exist in this room.")
+    return parent
+
+
+def edit_message(message, content):
+    """Change a message's content and tell the live sockets it was published to."""
+    validate_message(content, message.message_type, message.file)
+    content, is_flagged = moderate(message.room_id, content)
+    with transaction.atomic():
+        message.content = content
+        message.is_flagged = message.is_flagged or is_flagged
+        message.save(update_fields=['content', 'is_flagged', 'updated_at'])
+        OutboxEvent.objects.create(group=event_group(message), payload=change_event('message_edited', message))
+        transaction.on_commit(publisher.schedule)
+    return message
+
+
+def delete_message(message):
+    """
+    Replace a message with a tombstone, keeping its parent's thread summary
+    in step, and tell the live sockets it was published to.
+    """
+    if message.is_deleted:
+        return
+    with transaction.atomic():
+        message.is_deleted = True
+        message.deleted_at = timezone.now()
+        message.content = None
+        message.file = None
+        message.save(update_fields=['is_deleted', 'deleted_at', 'content', 'file', 'updated_at'])
+        if message.parent_id is not None:
+            last_reply = (
+                Message.objects.filter(parent_id=message.parent_id, is_deleted=False)
+                .aggregate(last=Max('timestamp'))['last']
+            )
+            Message.objects.filter(pk=message.parent_id, reply_count__gt=0).update(
+                reply_count=F('reply_count') - 1, last_reply_at=last_reply, updated_at=message.updated_at,
+            )
+        OutboxEvent.objects.create(group=event_group(message), payload=change_event('message_deleted', message))
+        transaction.on_commit(publisher.schedule)
+
+
+def notify_membership(user_ids, room, added=True):
+    """
+    Tell the users' multiplexed sockets to (un)subscribe from a room.
+    Must be called inside the transaction that changed the memberships.
+    """
+    notify_memberships([(user_id, room) for user_id in user_ids], added)
+
+
+def notify_memberships(pairs, added=True):
+    """Like ``notify_membership`` for ``(user_id, room)`` pairs spanning many rooms, in one insert."""
+    event_type = 'membership_added' if added else 'membership_removed'
+    OutboxEvent.objects.bulk_create(
+        [OutboxEvent(group=user_group_name(user_id), payload={'type': event_type, 'room': room.id, 'link': room.link})
+         for user_id, room in pairs],
+        batch_size=OUTBOX_BATCH_SIZE,
+    )
+    transaction.on_commit(publisher.schedule)
+
+
+def provision_rooms(admin, rooms):
+    """
+    Create many rooms with ``admin`` as their admin in a few statements.
+    Returns the created rooms and the requested public links that were taken.
+
+    Links are not checked before inserting: when the unique constraint trips,
+    taken public links are dropped, colliding random private links are redrawn
+    and the insert is retried.
+    """
+    pending, taken_links = list(rooms), []
+    for room in pending:
+        if room.room_type == 'PUBLIC' and not room.is_valid_link_format(room.link):
+            raise ValidationError(f"The link format is invalid: {room.link}.")
+        if room.room_type == 'PRIVATE' and not room.link:
+            room.link = room.generate_random_link()
+
+    for attempt in range(LINK_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                created = ChatRoom.objects.bulk_create(pending, batch_size=OUTBOX_BATCH_SIZE)
+                memberships = RoomMembership.objects.bulk_create(
+                    [RoomMembership(user=admin, room=room, role='ADMIN') for room in created],
+                    batch_size=OUTBOX_BATCH_SIZE,
+                )
+                notify_memberships([(admin.pk, membership.room) for membership in memberships])
+            break
+        except IntegrityError:
+            if attempt == LINK_ATTEMPTS - 1:
+                raise
+            taken = set()
+            for links in chunked(room.link for room in pending):
+                taken.update(ChatRoom.objects.filter(link__in=links).values_list('link', flat=True))
+            taken_links += [room.link for room in pending if room.room_type == 'PUBLIC' and room.link in taken]
+            pending = [room for room in pending if room.room_type != 'PUBLIC' or room.link not in taken]
+            for room in pending:
+                # The failed insert may have assigned primary keys before rolling back
+                room.pk = None
+                if room.link in taken:
+                    room.link = room.generate_random_link()
+
+    # Bulk inserts bypass the post_save signal
+    invalidate_public_rooms()
+    logger.info(f"{admin.username} provisioned {len(created)} rooms")
+    return created, taken_links
+
+
+def add_room_members(room, user_ids, role='MEMBER'):
+    """
+    Add existing users to a room in bulk, skipping current members.
+    Returns the ids of the users that were added.
+    """
+    added = []
+    with transaction.atomic():
+        for ids in chunked(set(user_ids)):
+            new_ids = list(
+                User.objects.filter(pk__in=ids).exclude(roommembership__room=room).values_list('pk', flat=True)
+            )
+            # A concurrent request may still add one of them first; the unique constraint settles it
+            RoomMembership.objects.bulk_create(
+                [RoomMembership(user_id=user_id, room=room, role=role) for user_id in new_ids],
+                ignore_conflicts=True,
+            )
+            added += new_ids
+        notify_membership(added, room)
+    return added
+
+
+def remove_room_members(room, user_ids):
+    """Remove users from a room in bulk. Returns the ids of the users that were removed."""
+    removed = []
+    with transaction.atomic():
+        for ids in chunked(set(user_ids)):
+            memberships = RoomMembership.objects.filter(room=room, user_id__in=ids)
+            removed += memberships.values_list('user_id', flat=True)
+            memberships.delete()
+        notify_membership(removed, room, added=False)
+    return removed
+
+
+def broadcast_message(user, rooms, content, message_type='TEXT', progress=None):
+    """
+    Persist one message per room with a single ``bulk_create`` and fan it out
+    to the rooms' live sockets. Returns the created messages.
+
+    The events are left to the outbox publisher after commit, so the caller
+    does not wait on the channel layer. With ``progress`` they are published
+    here instead, reporting how far the fan-out got; if that fails the
+    messages stay saved and their events stay in the outbox for a later run.
+    """
+    validate_message(content, message_type)
+    rooms = list(rooms)
+    with transaction.atomic():
+        messages = Message.objects.bulk_create(
+            [Message(user=user, room=room, content=content, message_type=message_type) for room in rooms],
+            batch_size=OUTBOX_BATCH_SIZE,
+        )
+        events = OutboxEvent.objects.bulk_create(
+            [OutboxEvent(group=room.group_name, payload=message_event(message, user.username))
+             for room, message in zip(rooms, messages)],
+            batch_size=OUTBOX_BATCH_SIZE,
+        )
+        if progress is None:
+            transaction.on_commit(publisher.schedule)
+
+    if progress is not None:
+        publish_outbox(ids=[event.id for event in events], progress=progress)
+        logger.info(f"Broadcast by {user.username} delivered to {len(rooms)} rooms")
+    return messages
+
+
+def resolve_direct_room(user, other_user):
+    """
+    Return the direct room between two users, creating it with both
+    memberships on first use. The room is keyed by a hash of the user pair, so
+    concurrent first connects race on the link's unique constraint.
+    """
+    link = ChatRoom.direct_link(user.pk, other_user.pk)
+    room = ChatRoom.objects.filter(link=link).first()
+    if room is not None:
+        return room
+
+    # Two long usernames can exceed the name column, so the name is cut to fit
+    name = ', '.join(sorted([user.username, other_user.username]))
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(
+                name=name[:ChatRoom._meta.get_field('name').max_length],
+                link=link,
+                room_type='DIRECT',
+            )
+            RoomMembership.objects.bulk_create([
+                RoomMembership(user=user, room=room),
+                RoomMembership(user=other_user, room=room),
+            ])
+            notify_membership([user.pk, other_user.pk], room)
+    except IntegrityError:
+        return ChatRoom.objects.get(link=link)
+    logger.info(f"Created new chat room with link: {link}")
+    return room
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .caching import invalidate_public_rooms
+from .models import ChatRoom
+from .moderation import forget_room_policy
+
+
+@receiver([post_save, post_delete], sender=ChatRoom)
+def room_changed(sender, instance, **kwargs):
+    invalidate_public_rooms()
+    forget_room_policy(instance.pk)
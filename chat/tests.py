@@ -1,3 +1,547 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import zlib
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .drain import make_resume_token
+from .frames import FrameEncoder, FrameSenderMixin
+from .management.commands.replay_traffic import load_recording
+from .models import ChatRoom, Message, OutboxEvent, PendingNotification, RoomMembership
+from .moderation import TermMatcher, mask, moderate
+from .notifications import queue_notifications
+from .outbox import group_send_many, publish_outbox, release_stale_claims
+from .presence import mark_online
+from .recorder import TrafficRecorder, recorded_query
+from .routing import websocket_urlpatterns
+from .services import delete_message, ingest_message, provision_rooms
+from .views import RoomChangesAPIView
 
-# Create your tests here.
+User = get_user_model()
+
+
+class TermMatcherTests(SimpleTestCase):
+    def find(self, terms, text):
+        return [text[start:end] for start, end in TermMatcher(terms).find(text)]
+
+    def test_matches_whole_words_only(self):
+        self.assertEqual(self.find(['bad'], 'bad badge abad bad.'), ['bad', 'bad'])
+        # Only letters and digits continue a word
+        self.assertEqual(self.find(['bad'], 'bad_word bad1 (bad)'), ['bad', 'bad'])
+
+    def test_is_case_insensitive(self):
+        self.assertEqual(self.find(['Bad Word'], 'a BAD word here'), ['BAD word'])
+
+    def test_reports_overlapping_terms(self):
+        text = 'he is a bad apple'
+        self.assertEqual(sorted(self.find(['bad', 'bad apple', 'apple'], text)), ['apple', 'bad', 'bad apple'])
+
+    def test_reports_terms_ending_inside_longer_terms(self):
+        # The automaton sits on "top-hat" when "hat" ends, so "hat" comes from the suffix link's outputs
+        self.assertEqual(sorted(self.find(['top-hat', 'hat'], 'a top-hat')), ['hat', 'top-hat'])
+
+    def test_follows_failure_links_after_a_partial_match(self):
+        self.assertEqual(self.find(['abcd', 'bc'], 'abc bc'), ['bc'])
+
+    def test_keeps_offsets_when_lowercasing_changes_length(self):
+        # "İ".lower() is two characters long
+        text = 'İİ spam İspam'
+        spans = TermMatcher(['spam']).find(text)
+        self.assertEqual(spans, [(3, 7)])
+        self.assertEqual(mask(text, spans), 'İİ **** İspam')
+
+    def test_ignores_blank_terms(self):
+        matcher = TermMatcher(['', '  ', 'x'])
+        self.assertEqual(matcher.find('a x'), [(2, 3)])
+
+
+class RecordingSender(FrameSenderMixin):
+    def __init__(self, query_string):
+        self.scope = {'query_string': query_string}
+        self.sent = []
+        self.setup_frames()
+
+    async def send(self, text_data=None, bytes_data=None):
+        self.sent.append(json.loads(text_data))
+
+
+class FrameTests(SimpleTestCase):
+    event = {'type': 'chat_message', 'id': 1, 'user': 'alice', 'message': 'hi',
+             'timestamp': '2024-01-01T00:00:00+00:00'}
+
+    def test_compact_schema_shortens_keys_and_timestamps(self):
+        encoder = FrameEncoder.from_scope({'query_string': b'schema=compact'})
+        self.assertEqual(json.loads(encoder.encode(self.event)['text_data']),
+                         {'t': 'chat_message', 'i': 1, 'u': 'alice', 'm': 'hi', 'ts': 1704067200000})
+
+    def test_compresses_frames_from_the_threshold(self):
+        encoder = FrameEncoder(compress=True, threshold=50)
+        self.assertIn('text_data', encoder.encode({'message': 'short'}))
+        frame = encoder.encode({'message': 'x' * 100})['bytes_data']
+        self.assertEqual(json.loads(zlib.decompress(frame, wbits=-zlib.MAX_WBITS)), {'message': 'x' * 100})
+
+    def test_batches_events_within_the_window_only_when_asked(self):
+        async def run(query_string):
+            sender = RecordingSender(query_string)
+            for n in range(3):
+                await sender.send_event({'type': 'chat_message', 'id': n})
+            await sender.flush_events()
+            return sender.sent
+
+        self.assertEqual([frame['id'] for frame in async_to_sync(run)(b'')], [0, 1, 2])
+        first, batch = async_to_sync(run)(b'batch=window')
+        self.assertEqual(first['id'], 0)
+        self.assertEqual(batch['type'], 'batch')
+        self.assertEqual([event['id'] for event in batch['events']], [1, 2])
+
+class ModerateTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('chat.moderation.moderator.get_matcher', return_value=TermMatcher(['spam']))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def moderate(self, policy, content='buy spam now'):
+        room = ChatRoom.objects.create(name=policy, link=policy.lower(), moderation_policy=policy)
+        return moderate(room.id, content)
+
+    def test_policies(self):
+        self.assertEqual(self.moderate('MASK'), ('buy **** now', False))
+        self.assertEqual(self.moderate('FLAG'), ('buy spam now', True))
+        self.assertEqual(self.moderate('OFF'), ('buy spam now', False))
+        with self.assertRaises(ValidationError):
+            self.moderate('REJECT')
+
+
+class DirectLinkTests(SimpleTestCase):
+    def test_is_symmetric(self):
+        self.assertEqual(ChatRoom.direct_link(3, 17), ChatRoom.direct_link(17, 3))
+
+    def test_differs_per_pair_and_fits_the_link_column(self):
+        links = {ChatRoom.direct_link(low, high) for low in range(1, 30) for high in range(low + 1, 30)}
+        self.assertEqual(len(links), 29 * 28 // 2)
+        max_length = ChatRoom._meta.get_field('link').max_length
+        self.assertTrue(all(len(link) <= max_length for link in links))
+
+
+class ThreadTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.room = ChatRoom.objects.create(name='Room', link='room')
+        self.parent = ingest_message(self.user, self.room, 'parent')
+
+    def reply(self, content):
+        return ingest_message(self.user, self.room, content, parent=self.parent)
+
+    def test_replies_keep_the_thread_summary_and_go_to_the_thread_group(self):
+        first, second = self.reply('one'), self.reply('two')
+        self.parent.refresh_from_db()
+        self.assertEqual((self.parent.reply_count, self.parent.last_reply_at), (2, second.timestamp))
+        self.assertEqual(OutboxEvent.objects.filter(group=f'thread_{self.parent.pk}').count(), 2)
+
+        delete_message(second)
+        self.parent.refresh_from_db()
+        self.assertEqual((self.parent.reply_count, self.parent.last_reply_at), (1, first.timestamp))
+
+    def test_rejects_a_parent_from_another_room(self):
+        other = ChatRoom.objects.create(name='Other', link='other')
+        with self.assertRaises(ValidationError):
+            ingest_message(self.user, other, 'lost', parent=self.parent)
+
+    def test_pages_through_a_thread_oldest_first(self):
+        replies = [self.reply(str(i)) for i in range(3)]
+        client = APIClient()
+        client.force_authenticate(self.user)
+        page = client.get(f'/chat/messages/{self.parent.pk}/thread/', {'page_size': 2}).json()
+        self.assertEqual([message['id'] for message in page['results']], [replies[0].pk, replies[1].pk])
+        page = client.get(page['next']).json()
+        self.assertEqual([message['id'] for message in page['results']], [replies[2].pk])
+        self.assertIsNone(page['next'])
+
+class RoomChangesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.room = ChatRoom.objects.create(name='Room', link='room', room_type='PRIVATE')
+        RoomMembership.objects.create(user=self.user, room=self.room)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def message(self, content):
+        return Message.objects.create(user=self.user, room=self.room, content=content)
+
+    def sync(self, watermark=None):
+        response = self.client.get('/chat/room-changes/room/', watermark or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_through_changes_and_stops(self):
+        messages = [self.message(str(i)) for i in range(5)]
+        # Ties on updated_at are broken by id
+        Message.objects.filter(pk__in=[messages[1].pk, messages[2].pk]).update(updated_at=messages[1].updated_at)
+
+        seen, watermark = [], None
+        with mock.patch.object(RoomChangesAPIView, 'page_size', 2):
+            while True:
+                page = self.sync(watermark)
+                seen += [change['id'] for change in page['changes'] if change['id'] not in seen]
+                if not page['more']:
+                    break
+                watermark = page['watermark']
+        self.assertEqual(seen, [message.id for message in messages])
+
+    def test_returns_edits_and_tombstones_after_the_watermark(self):
+        first, second = self.message('first'), self.message('second')
+        watermark = self.sync()['watermark']
+
+        first.content = 'edited'
+        first.save()
+        second.is_deleted = True
+        second.content = None
+        second.save()
+
+        changes = self.sync(watermark)['changes']
+        self.assertEqual([(change['id'], change['content'], change['is_deleted']) for change in changes],
+                         [(first.id, 'edited', False), (second.id, None, True)])
+
+    def test_resends_changes_committed_late_within_the_overlap(self):
+        messages = [self.message(str(i)) for i in range(3)]
+        watermark = self.sync()['watermark']
+
+        # Committed after the sync, but stamped before the watermark
+        Message.objects.filter(pk=messages[0].pk).update(
+            content='late', updated_at=messages[2].updated_at - timedelta(milliseconds=1),
+        )
+        Message.objects.filter(pk=messages[1].pk).update(
+            updated_at=messages[2].updated_at - RoomChangesAPIView.overlap - timedelta(seconds=1),
+        )
+
+        page = self.sync(watermark)
+        contents = {change['id']: change['content'] for change in page['changes']}
+        self.assertEqual(contents[messages[0].id], 'late')
+        self.assertNotIn(messages[1].id, contents)
+        self.assertIsNone(page['watermark'])
+        self.assertFalse(page['more'])
+
+    def test_rejects_malformed_watermarks(self):
+        response = self.client.get('/chat/room-changes/room/', {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CreateChatRoomTests(TestCase):
+    def test_makes_the_creator_admin_and_subscribes_their_sockets(self):
+        user = User.objects.create(username='alice')
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch('chat.services.publisher.schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/chat/new-room/', {'name': 'Room', 'link': 'room', 'room_type': 'PUBLIC'})
+        self.assertEqual(response.status_code, 201)
+        schedule.assert_called_once_with()
+
+        room = ChatRoom.objects.get(link='room')
+        self.assertEqual(RoomMembership.objects.get(room=room).role, 'ADMIN')
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.group, f'user_{user.pk}')
+        self.assertEqual(event.payload, {'type': 'membership_added', 'room': room.pk, 'link': 'room'})
+
+class ProvisionRoomsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin')
+        ChatRoom.objects.create(name='Taken', link='taken')
+        ChatRoom.objects.create(name='Secret', link='secret0000000', room_type='PRIVATE')
+        patcher = mock.patch('chat.services.publisher.schedule')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reports_taken_public_links(self):
+        created, taken = provision_rooms(self.admin, [
+            ChatRoom(name='A', link='taken'), ChatRoom(name='B', link='fresh'),
+        ])
+        self.assertEqual(taken, ['taken'])
+        self.assertEqual([room.link for room in created], ['fresh'])
+        self.assertEqual(RoomMembership.objects.get(room__link='fresh').role, 'ADMIN')
+        self.assertEqual(ChatRoom.objects.filter(link='taken').count(), 1)
+
+    def test_redraws_colliding_private_links(self):
+        links = iter(['secret0000000', 'secret0000001'])
+        with mock.patch.object(ChatRoom, 'generate_random_link', side_effect=lambda: next(links)):
+            created, taken = provision_rooms(self.admin, [
+                ChatRoom(name='C', room_type='PRIVATE'), ChatRoom(name='D', link='other'),
+            ])
+        self.assertEqual(taken, [])
+        self.assertEqual(sorted(room.link for room in created), ['other', 'secret0000001'])
+        self.assertEqual(OutboxEvent.objects.filter(group=f'user_{self.admin.pk}').count(), 2)
+
+class PublicRoomListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='alice'))
+        self.rooms = [ChatRoom.objects.create(name=f'Room {i}', link=f'room_{i}') for i in range(3)]
+
+    def test_revalidates_after_a_room_is_deleted(self):
+        etag = self.client.get('/chat/rooms/')['ETag']
+        self.assertEqual(self.client.get('/chat/rooms/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Deleting through a queryset skips the signals, like a delete made by another worker
+        ChatRoom.objects.filter(pk=self.rooms[2].pk).delete()
+        response = self.client.get('/chat/rooms/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([room['link'] for room in response.json()], ['room_0', 'room_1'])
+        self.assertNotIn('Last-Modified', response)
+
+
+class RoomExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.room = ChatRoom.objects.create(name='Room', link='room')
+        self.messages = [Message.objects.create(user=self.user, room=self.room, content=str(i)) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/chat/room-export/room/', params)
+        self.assertEqual(response.status_code, 200)
+        async def read():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        return response, async_to_sync(read)()
+
+    def test_streams_ndjson_after_a_message(self):
+        response, body = self.export(after=self.messages[0].pk)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['message'] for line in body.splitlines()], ['1', '2'])
+
+    def test_gzip_download_is_labelled_as_gzip(self):
+        response, body = self.export(compression='gzip')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('filename="room.ndjson.gz"', response['Content-Disposition'])
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 3)
+
+class RecordingLayer:
+    """Channel layer stand-in where a send started later can finish first."""
+
+    def __init__(self, fail=False):
+        self.sent = []
+        self.fail = fail
+
+    async def group_send(self, group, event):
+        if self.fail:
+            raise ConnectionError('layer unavailable')
+        await asyncio.sleep(0.01 / (event['n'] + 1))
+        self.sent.append((group, event['n']))
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.layer = RecordingLayer()
+        patcher = mock.patch('chat.outbox.get_channel_layer', side_effect=lambda: self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def event(self, group, n, **fields):
+        return OutboxEvent.objects.create(group=group, payload={'type': 'test', 'n': n}, **fields)
+
+    def test_keeps_the_order_of_events_within_a_group(self):
+        events = [('a', {'n': 0}), ('a', {'n': 1}), ('b', {'n': 0}), ('a', {'n': 2}), ('b', {'n': 1})]
+        self.assertEqual(async_to_sync(group_send_many)(events), 5)
+        self.assertEqual([n for group, n in self.layer.sent if group == 'a'], [0, 1, 2])
+        self.assertEqual([n for group, n in self.layer.sent if group == 'b'], [0, 1])
+
+    def test_publishes_and_deletes_unclaimed_events(self):
+        self.event('a', 0)
+        self.event('a', 1)
+        taken = self.event('a', 2, claim='other', claimed_at=timezone.now())
+
+        self.assertEqual(publish_outbox(batch_size=1), 2)
+        self.assertEqual(self.layer.sent, [('a', 0), ('a', 1)])
+        self.assertEqual(list(OutboxEvent.objects.all()), [taken])
+
+    def test_releases_the_claim_when_sending_fails(self):
+        self.layer = RecordingLayer(fail=True)
+        event = self.event('a', 0)
+        with self.assertRaises(ConnectionError):
+            publish_outbox()
+        event.refresh_from_db()
+        self.assertIsNone(event.claim)
+
+    def test_releases_stale_claims_only(self):
+        stale = self.event('a', 0, claim='dead', claimed_at=timezone.now() - timedelta(minutes=5))
+        fresh = self.event('a', 1, claim='busy', claimed_at=timezone.now())
+        self.assertEqual(release_stale_claims(60), 1)
+        stale.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertIsNone(stale.claim)
+        self.assertEqual(fresh.claim, 'busy')
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', is_staff=True)
+        self.rooms = [ChatRoom.objects.create(name=f'Room {i}', link=f'room_{i}') for i in range(2)]
+        patcher = mock.patch('chat.outbox.get_channel_layer', return_value=RecordingLayer(fail=True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_view_leaves_delivery_to_the_publisher(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with mock.patch('chat.services.publisher.schedule') as schedule, self.captureOnCommitCallbacks(execute=True):
+            response = client.post('/chat/broadcast/', {'message': 'hello', 'rooms': ['room_0', 'room_1']},
+                                   format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['delivery'], 'pending')
+        schedule.assert_called_once_with()
+        self.assertEqual(Message.objects.filter(content='hello').count(), 2)
+        self.assertEqual(OutboxEvent.objects.filter(claim__isnull=True).count(), 2)
+
+    def test_command_keeps_undelivered_events_for_a_retry(self):
+        stderr = io.StringIO()
+        call_command('broadcast', 'hello', user='admin', room_type='PUBLIC', stdout=io.StringIO(), stderr=stderr)
+        self.assertIn('not delivered', stderr.getvalue())
+        self.assertEqual(Message.objects.filter(content='hello').count(), 2)
+        self.assertEqual(OutboxEvent.objects.filter(claim__isnull=True).count(), 2)
+
+class QueueNotificationsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.alice, self.bob, self.carol, self.dave = [
+            User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave')
+        ]
+        self.rooms = [ChatRoom.objects.create(name=f'Room {i}', link=f'room_{i}') for i in range(2)]
+        for user in (self.alice, self.bob, self.carol, self.dave):
+            RoomMembership.objects.create(user=user, room=self.rooms[0])
+        RoomMembership.objects.create(user=self.dave, room=self.rooms[1])
+
+    def send(self, user, room, content):
+        return Message.objects.create(user=user, room=room, content=content)
+
+    def pending(self):
+        return {
+            (entry.room_id, entry.user.username): (entry.count, entry.preview, entry.last_message_id)
+            for entry in PendingNotification.objects.select_related('user')
+        }
+
+    def test_coalesces_messages_per_room_for_offline_members(self):
+        mark_online(self.bob.pk, self.rooms[0].pk)
+        first = [self.send(self.alice, self.rooms[0], 'one'), self.send(self.carol, self.rooms[0], 'two'),
+                 self.send(self.alice, self.rooms[1], 'other room')]
+        self.assertEqual(queue_notifications([message.pk for message in first]), 4)
+
+        room, other = self.rooms
+        self.assertEqual(self.pending(), {
+            # Senders skip their own messages, online members get nothing
+            (room.pk, 'alice'): (1, 'two', first[1].pk),
+            (room.pk, 'carol'): (1, 'two', first[1].pk),
+            (room.pk, 'dave'): (2, 'two', first[1].pk),
+            (other.pk, 'dave'): (1, 'other room', first[2].pk),
+        })
+
+        later = self.send(self.alice, room, 'three')
+        queue_notifications([later.pk])
+        pending = self.pending()
+        self.assertEqual(pending[room.pk, 'dave'], (3, 'three', later.pk))
+        self.assertEqual(pending[room.pk, 'carol'], (2, 'three', later.pk))
+        self.assertEqual(pending[room.pk, 'alice'], (1, 'two', first[1].pk))
+        self.assertEqual(pending[other.pk, 'dave'], (1, 'other room', first[2].pk))
+
+    def test_ignores_replies(self):
+        parent = self.send(self.alice, self.rooms[0], 'parent')
+        reply = Message.objects.create(user=self.alice, room=self.rooms[0], content='reply', parent=parent)
+        self.assertEqual(queue_notifications([reply.pk]), 0)
+        self.assertFalse(PendingNotification.objects.exists())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ResumeTokenTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.alice = User(pk=1, username='alice')
+        self.bob = User(pk=2, username='bob')
+
+    def connect(self, token_user=None, link='room'):
+        resume = make_resume_token({'u': self.alice.pk, 'n': self.alice.username, 'r': 7, 'l': link})
+        headers = [(b'host', b'localhost')]
+        if token_user is not None:
+            headers.append((b'authorization', f'Bearer {AccessToken.for_user(token_user)}'.encode()))
+
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/room/?resume={resume}',
+                                                 headers=headers)
+            connected, code = await communicator.connect()
+            if connected:
+                await communicator.disconnect()
+            return connected, code
+
+        return async_to_sync(run)()
+
+    def test_resumes_with_the_same_users_jwt_without_lookups(self):
+        # SimpleTestCase fails any database query
+        self.assertEqual(self.connect(token_user=self.alice), (True, None))
+
+    def test_requires_a_jwt(self):
+        self.assertEqual(self.connect(), (False, 4003))
+
+    def test_rejects_another_users_jwt(self):
+        self.assertEqual(self.connect(token_user=self.bob), (False, 4003))
+
+
+class TrafficRecordingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'traffic.jsonl')
+
+    def test_keeps_only_harmless_query_values(self):
+        scope = {'query_string': b'schema=compact&resume=secret&token=abc&page_size=20'}
+        self.assertEqual(recorded_query(scope), {'page_size': '20', 'schema': 'compact', 'token': None})
+
+    def test_records_the_shape_of_requests_without_their_content(self):
+        async def app(scope, receive, send):
+            await receive()
+            await send({'type': 'http.response.start', 'status': 201, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'{"secret":"reply"}'})
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'{"message":"hidden"}'}
+
+        async def send(message):
+            pass
+
+        recorder = TrafficRecorder(app, self.path)
+        scope = {'type': 'http', 'method': 'POST', 'path': '/chat/messages/', 'query_string': b''}
+        async_to_sync(recorder)(scope, receive, send)
+        recorder.log.flush()
+
+        with open(self.path, encoding='utf8') as recording:
+            content = recording.read()
+        self.assertNotIn('hidden', content)
+        self.assertNotIn('secret', content)
+        header, record = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(header['v'], 1)
+        self.assertEqual((record['e'], record['m'], record['p'], record['s']), ('http', 'POST', '/chat/messages/', 201))
+        self.assertEqual((record['n'], record['o']), (20, 18))
+
+    def test_merges_segments_of_several_workers_on_one_timeline(self):
+        lines = [
+            {'v': 1, 'pid': 1, 'start': 100.0}, {'t': 0.5, 'e': 'open', 'c': 1, 'r': 'user'},
+            {'v': 1, 'pid': 2, 'start': 100.2}, {'t': 0.1, 'e': 'open', 'c': 1, 'r': 'user'},
+        ]
+        with open(self.path, 'w', encoding='utf8') as recording:
+            recording.writelines(json.dumps(line) + '\n' for line in lines)
+        events = load_recording(self.path)
+        self.assertEqual([event['c'] for event in events], [(2, 1), (1, 1)])
+        self.assertEqual([round(event['t'], 3) for event in events], [0, 0.2])
@@ -1,17 +1,24 @@
 from django.urls import path
 from .views import (
     PublicChatRoomListAPIView, ChatRoomDetailAPIView,
-    MessageListCreateAPIView, MessageDetailAPIView,
-    CreateChatRoomView, MyDirectChatRoomView, AddRoomMembershipView
+    MessageListCreateAPIView, MessageDetailAPIView, MessageThreadAPIView,
+    CreateChatRoomView, MyDirectChatRoomView, AddRoomMembershipView,
+    BroadcastMessageView, RoomExportView, BulkCreateChatRoomView, RoomMembersView, RoomChangesAPIView
 )
 
 urlpatterns = [
     path('new-room/', CreateChatRoomView.as_view(), name='create-room'),
     path('direct-rooms/', MyDirectChatRoomView.as_view(), name='create-room'),
+    path('new-rooms/', BulkCreateChatRoomView.as_view(), name='create-rooms'),
     path('add-membership/', AddRoomMembershipView.as_view()),
+    path('room-members/<str:room_link>/', RoomMembersView.as_view(), name='chatroom-members'),
     path('rooms/', PublicChatRoomListAPIView.as_view(), name='chatroom-list'),
     path('room-detail/<str:room_link>/', ChatRoomDetailAPIView.as_view(), name='chatroom-detail'),
+    path('room-export/<str:room_link>/', RoomExportView.as_view(), name='chatroom-export'),
+    path('room-changes/<str:room_link>/', RoomChangesAPIView.as_view(), name='chatroom-changes'),
 
     path('messages/', MessageListCreateAPIView.as_view(), name='message-list'),
     path('messages/<int:pk>/', MessageDetailAPIView.as_view(), name='message-detail'),
+    path('messages/<int:pk>/thread/', MessageThreadAPIView.as_view(), name='message-thread'),
+    path('broadcast/', BroadcastMessageView.as_view(), name='message-broadcast'),
 ]
@@ -1,10 +1,28 @@
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated
+from django.utils.dateparse import parse_datetime
+from rest_framework import generics, serializers, status
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .models import ChatRoom, RoomMembership, Message
-from .serializers import ChatRoomSerializer, RoomMembershipSerializer, MessageSerializer
+from .serializers import (
+    ChatRoomSerializer, RoomMembershipSerializer, MessageSerializer, BroadcastMessageSerializer,
+    BulkRoomSerializer, RoomMembersSerializer
+)
+from .services import (
+    add_room_members, broadcast_message, delete_message, edit_message, ingest_message, notify_membership,
+    provision_rooms, remove_room_members
+)
+from .caching import get_public_rooms, set_public_rooms
+from .export import export_rows, gzipped, iterate_in_thread, ndjson_lines
+from config.conditional import make_etag, not_modified, with_validators
 
 
 class CreateChatRoomView(APIView):
@@ -13,13 +31,15 @@ class CreateChatRoomView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = ChatRoomSerializer(data=request.data)
         if serializer.is_valid():
-            room = serializer.save()
-
-            RoomMembership.objects.create(
-                user=request.user,
-                room=room,
-                role='ADMIN'
-            )
+            with transaction.atomic():
+                room = serializer.save()
+                RoomMembership.objects.create(
+                    user=request.user,
+                    room=room,
+                    role='ADMIN'
+                )
+                # Open multiplexed sockets of the creator subscribe to the new room
+                notify_membership([request.user.pk], room)
 
             response_data = {
                 "message": "Room created successfully",
@@ -55,20 +75,36 @@ class PublicChatRoomListAPIView(generics.ListAPIView):
     serializer_class = ChatRoomSerializer
     permission_classes = [IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        # The version is read on every request so that workers holding an older copy, or a list
+        # that lost a room, never answer with it; the row count changes when a room is deleted
+        version = self.get_queryset().aggregate(count=Count('id'), last=Max('updated_at'))
+        etag = make_etag(version['count'], version['last'].timestamp() if version['last'] else None)
+        response = not_modified(request, etag)
+        if response is None:
+            # The serialized list is cached and reused while its version is current
+            cached = get_public_rooms()
+            if cached is None or cached['etag'] != etag:
+                cached = {'etag': etag, 'data': list(self.get_serializer(self.get_queryset(), many=True).data)}
+                set_public_rooms(cached)
+            response = Response(cached['data'])
+        return with_validators(response, etag)
+
 # View for retrieving, updating, and deleting a specific chat room
 class ChatRoomDetailAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, room_link):
         chatroom = get_object_or_404(ChatRoom, link=room_link)
-        if chatroom.room_type == "PUBLIC":
-            return Response(ChatRoomSerializer(chatroom).data, status=status.HTTP_200_OK)
-        elif chatroom.room_type == "PRIVATE":
-            if RoomMembership.objects.filter(room=chatroom, user=request.user).exists():
-                return Response(ChatRoomSerializer(chatroom).data, status=status.HTTP_200_OK)
-            else:
-                return Response({'error': 'You do not have permission to view this room.'},
-                                status=status.HTTP_403_FORBIDDEN)
+        if not chatroom.is_visible_to(request.user):
+            return Response({'error': 'You do not have permission to view this room.'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        etag = make_etag(chatroom.id, chatroom.updated_at.timestamp())
+        response = not_modified(request, etag, chatroom.updated_at)
+        if response is None:
+            response = Response(ChatRoomSerializer(chatroom).data, status=status.HTTP_200_OK)
+        return with_validators(response, etag, chatroom.updated_at)
 
 
 
@@ -84,25 +120,239 @@ class AddRoomMembershipView(APIView):
             return Response({'error': 'room_link query parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
         user = request.user
         room = get_object_or_404(ChatRoom, link=room_link)
-        if RoomMembership.objects.filter(user=user, room=room).exists():
+        try:
+            with transaction.atomic():
+                membership = RoomMembership(user=user, room=room, role='MEMBER')  # Default to MEMBER role
+                membership.save()
+                notify_membership([user.pk], room)
+        except IntegrityError:
             return Response({'detail': 'User is already a member of this room.'}, status=status.HTTP_400_BAD_REQUEST)
-        membership = RoomMembership(user=user, room=room, role='MEMBER')  # Default to MEMBER role
-        membership.save()
         serializer = RoomMembershipSerializer(membership)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+class BulkCreateChatRoomView(APIView):
+    """
+    API view for admins to create many rooms in one request, becoming their admin.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = BulkRoomSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            rooms, taken = provision_rooms(
+                request.user, [ChatRoom(**spec) for spec in serializer.validated_data['rooms']]
+            )
+        except ValidationError as error:
+            return Response({'error': error.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            "message": "Rooms created successfully",
+            "rooms": [{"id": room.id, "name": room.name, "link": room.link} for room in rooms],
+            "taken": taken,
+        }, status=status.HTTP_201_CREATED)
+
+
+class RoomMembersView(APIView):
+    """
+    API view for room admins to add (POST) or remove (DELETE) many members at once.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_room(self, request, room_link):
+        room = get_object_or_404(ChatRoom.objects.exclude(room_type='DIRECT'), link=room_link)
+        if not room.is_administered_by(request.user):
+            raise PermissionDenied('Only room admins can manage members.')
+        return room
+
+    def post(self, request, room_link):
+        room = self.get_room(request, room_link)
+        serializer = RoomMembersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        added = add_room_members(room, serializer.validated_data['users'], serializer.validated_data['role'])
+        return Response({"added": added}, status=status.HTTP_200_OK)
+
+    def delete(self, request, room_link):
+        room = self.get_room(request, room_link)
+        serializer = RoomMembersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        removed = remove_room_members(room, serializer.validated_data['users'])
+        return Response({"removed": removed}, status=status.HTTP_200_OK)
+
 # View for listing and creating messages
 class MessageListCreateAPIView(generics.ListCreateAPIView):
-    queryset = Message.objects.all()
+    queryset = Message.objects.filter(is_deleted=False)
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        if not serializer.validated_data['room'].has_member(self.request.user):
+            raise PermissionDenied('User is not a member of this room.')
+        try:
+            serializer.instance = ingest_message(self.request.user, **serializer.validated_data)
+        except ValidationError as error:
+            raise serializers.ValidationError(error.messages)
 
 # View for retrieving, updating, and deleting a specific message
 class MessageDetailAPIView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Message.objects.all()
+    """
+    Only the content of a message can be edited, by its author. Authors and
+    room admins can delete it. Edits and deletions are published to the
+    message's room (or thread) so live sockets can update.
+    """
+    queryset = Message.objects.filter(is_deleted=False).select_related('room')
+    serializer_class = MessageSerializer
+    permission_classes = [IsAuthenticated]
+
+    def perform_update(self, serializer):
+        if serializer.instance.user_id != self.request.user.pk:
+            raise PermissionDenied('Only the author can edit a message.')
+        content = serializer.validated_data.get('content', serializer.instance.content)
+        try:
+            serializer.instance = edit_message(serializer.instance, content)
+        except ValidationError as error:
+            raise serializers.ValidationError(error.messages)
+
+    def perform_destroy(self, instance):
+        if instance.user_id != self.request.user.pk and not instance.room.is_administered_by(self.request.user):
+            raise PermissionDenied('Only the author or a room admin can delete a message.')
+        delete_message(instance)
+
+
+class ThreadPagination(CursorPagination):
+    ordering = 'timestamp'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class MessageThreadAPIView(generics.ListAPIView):
+    """
+    API view listing the replies to a message, oldest first.
+    """
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ThreadPagination
+
+    def get_queryset(self):
+        if getattr(self, 'swagger_fake_view', False):
+            # Schema generation has no parent message to look up
+            return Message.objects.none()
+        parent = get_object_or_404(Message.objects.select_related('room'), pk=self.kwargs['pk'])
+        if not parent.room.is_visible_to(self.request.user):
+            raise PermissionDenied('You do not have permission to view this room.')
+        return Message.objects.filter(parent=parent, is_deleted=False).select_related('user')
+
+
+class RoomChangesAPIView(APIView):
+    """
+    API view returning the messages of a room created, edited or deleted
+    since a watermark, oldest change first. Deleted messages come back as
+    tombstones with ``is_deleted`` set.
+
+    Query parameters: ``since`` (an ``updated_at`` timestamp) and ``after``
+    (a message id breaking ties on that timestamp). The response carries the
+    watermark to send next time; ``more`` is true while changes remain.
+
+    ``updated_at`` is taken before commit, so a change can become visible
+    after later ones were synced. Changes up to ``overlap`` behind the
+    watermark are therefore sent again; clients skip those whose
+    ``(id, updated_at)`` they already applied.
+    """
+    permission_classes = [IsAuthenticated]
+    page_size = 200
+    overlap = timedelta(seconds=5)
+
+    def get(self, request, room_link):
+        room = get_object_or_404(ChatRoom, link=room_link)
+        if not room.is_visible_to(request.user):
+            return Response({'error': 'You do not have permission to view this room.'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        changes = Message.objects.filter(room=room).select_related('user').order_by('updated_at', 'id')
+        late = []
+        since = request.query_params.get('since')
+        if since:
+            since = parse_datetime(since)
+            after = request.query_params.get('after', '0')
+            if since is None or not after.isdigit():
+                return Response({'error': 'since must be a timestamp and after a message id.'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            # Ranges on the (room, updated_at) index: the overlap up to the watermark, then what follows it
+            late = list(
+                changes.filter(updated_at__gte=since - self.overlap, updated_at__lte=since)
+                .exclude(updated_at=since, id__gt=int(after))
+            )
+            changes = changes.filter(updated_at__gte=since).exclude(updated_at=since, id__lte=int(after))
+
+        page = list(changes[:self.page_size + 1])
+        more = len(page) > self.page_size
+        page = page[:self.page_size]
+        watermark = {'since': page[-1].updated_at.isoformat(), 'after': page[-1].id} if page else None
+        return Response({
+            'changes': MessageSerializer(late + page, many=True).data,
+            'watermark': watermark,
+            'more': more,
+        })
+
+
+class BroadcastMessageView(APIView):
+    """
+    API view for admins to post one message to many rooms at once.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = BroadcastMessageSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        rooms = ChatRoom.objects.exclude(room_type='DIRECT').only('id', 'link')
+        if data.get('rooms'):
+            rooms = rooms.filter(link__in=data['rooms'])
+        if data.get('room_type'):
+            rooms = rooms.filter(room_type=data['room_type'])
+        rooms = list(rooms)
+        if not rooms:
+            return Response({'error': 'No matching rooms found.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        messages = broadcast_message(request.user, rooms, data['message'])
+
+        found = {room.link for room in rooms}
+        return Response({
+            "message": "Broadcast sent successfully",
+            "rooms": len(messages),
+            # Live sockets get the messages from the outbox publisher shortly after
+            "delivery": "pending",
+            "missing": [link for link in data.get('rooms', []) if link not in found],
+        }, status=status.HTTP_201_CREATED)
+
+
+class RoomExportView(APIView):
+    """
+    API view streaming a room's history as NDJSON, optionally gzipped.
+
+    Query parameters: ``compression=gzip`` and ``after=<message id>`` to
+    resume from the last exported message.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_link):
+        room = get_object_or_404(ChatRoom, link=room_link)
+        if not room.is_visible_to(request.user):
+            return Response({'error': 'You do not have permission to view this room.'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        after = request.query_params.get('after')
+        if after is not None and not after.isdigit():
+            return Response({'error': 'after must be a message id.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunks = ndjson_lines(export_rows(room, after=int(after) if after else None))
+        filename, content_type = f'{room.link}.ndjson', 'application/x-ndjson'
+        if request.query_params.get('compression') == 'gzip':
+            # A .gz file to save, not a compressed NDJSON body for the client to decode
+            chunks = gzipped(chunks)
+            filename, content_type = f'{filename}.gz', 'application/gzip'
 
+        response = StreamingHttpResponse(iterate_in_thread(chunks), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
@@ -1,19 +1,19 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-from channels.security.websocket import AllowedHostsOriginValidator
-from chat.routing import websocket_urlpatterns
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Set up Django before importing anything that touches models
+http_application = get_asgi_application()
+
+from django.conf import settings
+from channels.routing import ProtocolTypeRouter
+from chat.recorder import TrafficRecorder
+from config.asgi_ws import websocket_application  # also installs the drain signal
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
-            URLRouter(
-                websocket_urlpatterns
-            )
-        )
-    ),
+    "http": http_application,
+    "websocket": websocket_application,
 })
+
+if getattr(settings, 'CHAT_TRAFFIC_RECORD_FILE', None):
+    application = TrafficRecorder(application, settings.CHAT_TRAFFIC_RECORD_FILE)
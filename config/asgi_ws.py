@@ -0,0 +1,33 @@
+"""
+ASGI entry point for workers serving WebSockets only.
+
+Run it with ``daphne config.asgi_ws:application`` behind a proxy routing
+``/ws/`` to these workers. Nothing of the HTTP stack (URLconf, views,
+middleware, API docs) is imported, which keeps cold starts short.
+"""
+
+import os
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings_ws')
+django.setup()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.auth import AuthMiddlewareStack
+from channels.security.websocket import AllowedHostsOriginValidator
+from chat.drain import install_drain_signal
+from chat.routing import websocket_urlpatterns
+
+websocket_application = AllowedHostsOriginValidator(
+    AuthMiddlewareStack(
+        URLRouter(
+            websocket_urlpatterns
+        )
+    )
+)
+
+application = ProtocolTypeRouter({
+    "websocket": websocket_application,
+})
+
+install_drain_signal()
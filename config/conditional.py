@@ -0,0 +1,33 @@
+"""
+Helpers for answering conditional GET requests from API views.
+
+Views compute their validators from cheap version data (``updated_at``
+columns, row counts) and only serialize when the client's copy is stale.
+"""
+
+import hashlib
+from calendar import timegm
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    """Build an entity tag from the given version parts."""
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _timestamp(last_modified):
+    return timegm(last_modified.utctimetuple()) if last_modified else None
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 response if the client's validators still match, otherwise None."""
+    return get_conditional_response(request, etag=quote_etag(etag), last_modified=_timestamp(last_modified))
+
+
+def with_validators(response, etag, last_modified=None):
+    """Attach the ETag and Last-Modified headers to a response."""
+    response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(_timestamp(last_modified))
+    return response
@@ -70,6 +70,7 @@ SIMPLE_JWT = {
 }
 
 SWAGGER_SETTINGS = {
+    'DEFAULT_INFO': 'config.schema.api_info',
     'SECURITY_DEFINITIONS': {
         'Bearer': {
             'type': 'apiKey',
@@ -122,6 +123,10 @@ DATABASES = {
     }
 }
 
+AUTHENTICATION_BACKENDS = [
+    'user.backends.PooledModelBackend',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
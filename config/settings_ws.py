@@ -0,0 +1,22 @@
+"""
+Settings for WebSocket-only workers (``config.asgi_ws``).
+
+Same as ``config.settings`` minus the apps only the HTTP side uses, so that
+``django.setup()`` imports less: the admin and its autodiscovery, the API
+docs, static files and flash messages.
+"""
+
+from .settings import *
+
+HTTP_ONLY_APPS = [
+    'daphne',
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_yasg',
+]
+
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in HTTP_ONLY_APPS]
+
+# These workers never route HTTP requests
+ROOT_URLCONF = None
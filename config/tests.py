@@ -0,0 +1,36 @@
+import json
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from rest_framework.test import APIClient
+from .schema import BaseSchemaView, SchemaView
+
+
+class SchemaViewTests(SimpleTestCase):
+    def setUp(self):
+        SchemaView._schemas.clear()
+        self.addCleanup(SchemaView._schemas.clear)
+        self.client = APIClient()
+
+    def test_generates_the_spec_once_per_process(self):
+        with mock.patch.object(BaseSchemaView, 'get', autospec=True, side_effect=BaseSchemaView.get) as generate:
+            first = self.client.get('/swagger.json/')
+            second = self.client.get('/swagger.json/')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(json.loads(first.content), json.loads(second.content))
+        self.assertIn('/chat/broadcast/', json.loads(first.content)['paths'])
+        self.assertNotIn('host', json.loads(first.content))
+        self.assertEqual(generate.call_count, 1)
+
+    def test_serves_a_precomputed_schema_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'openapi.json')
+            with open(path, 'w', encoding='utf8') as schema_file:
+                json.dump({'swagger': '2.0', 'info': {'title': 'Precomputed', 'version': 'v1'}, 'paths': {}},
+                          schema_file)
+            with mock.patch('config.schema.SCHEMA_FILE', path), \
+                    mock.patch.object(BaseSchemaView, 'get') as generate:
+                response = self.client.get('/swagger.json/')
+        self.assertEqual(json.loads(response.content)['info']['title'], 'Precomputed')
+        generate.assert_not_called()
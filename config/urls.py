@@ -1,27 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
+from config.schema import SchemaView
 
 
-schema_view = get_schema_view(
-   openapi.Info(
-      title="Messenget API",
-      default_version='v1',
-      description="Test description",
-      terms_of_service="https://www.google.com/policies/terms/",
-      contact=openapi.Contact(email="cbekoder@gmail.com"),
-      license=openapi.License(name="BSD License"),
-   ),
-   public=True,
-   permission_classes=(permissions.AllowAny,),
-)
-
 urlpatterns = [
-   path('swagger<format>/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-   path('', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-   path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+   path('swagger<format>/', SchemaView.without_ui(), name='schema-json'),
+   path('', SchemaView.with_ui('swagger'), name='schema-swagger-ui'),
+   path('redoc/', SchemaView.with_ui('redoc'), name='schema-redoc'),
     path('admin/', admin.site.urls),
     path('user/', include('user.urls')),
     path('chat/', include('chat.urls')),
@@ -0,0 +1,110 @@
+"""
+Password hashing off the request workers.
+
+PBKDF2 deliberately burns hundreds of milliseconds of CPU per call. Hashing
+and verification are sent to a bounded process pool so a login burst cannot
+pin every request worker. Requests beyond ``PASSWORD_HASHING_QUEUE`` pending
+operations wait up to ``PASSWORD_HASHING_TIMEOUT`` seconds for a slot and are
+then answered with 503.
+
+A pool whose worker died (OOM kill, crash) is broken for good, so it is
+replaced and the call retried once before answering 503.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+PASSWORD_HASHING_WORKERS = getattr(settings, 'PASSWORD_HASHING_WORKERS', os.cpu_count() or 1)
+PASSWORD_HASHING_QUEUE = getattr(settings, 'PASSWORD_HASHING_QUEUE', PASSWORD_HASHING_WORKERS * 4)
+PASSWORD_HASHING_TIMEOUT = getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 5)
+
+
+class HashingPoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many concurrent sign-ins, try again later.'
+    default_code = 'hashing_pool_busy'
+
+
+def _setup_worker():
+    import django
+    django.setup()
+
+
+class PasswordHashingPool:
+    """Process pool with admission control. With no workers, calls run inline."""
+
+    def __init__(self, workers=PASSWORD_HASHING_WORKERS, queue_size=PASSWORD_HASHING_QUEUE,
+                 timeout=PASSWORD_HASHING_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(queue_size, 1))
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # Workers are spawned rather than forked from a multi-threaded server
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_setup_worker,
+                )
+            return self._executor
+
+    def run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingPoolBusy()
+        try:
+            for attempt in range(2):
+                executor = self.get_executor()
+                try:
+                    return executor.submit(func, *args).result()
+                except BrokenProcessPool:
+                    self.discard_executor(executor)
+            raise HashingPoolBusy('Password hashing is unavailable, try again later.')
+        finally:
+            self._slots.release()
+
+    def discard_executor(self, executor):
+        with self._lock:
+            # Concurrent callers may have replaced it already
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+pool = PasswordHashingPool()
+
+
+def hash_password(raw_password):
+    return pool.run(make_password, raw_password)
+
+
+def verify_password(raw_password, encoded):
+    return pool.run(check_password, raw_password, encoded)
+
+
+def needs_rehash(encoded):
+    """Whether a verified password should be rehashed with the preferred hasher."""
+    preferred = get_hasher('default')
+    try:
+        current = identify_hasher(encoded)
+    except ValueError:
+        return True
+    return current.algorithm != preferred.algorithm or preferred.must_update(encoded)
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.cache import cache
+from .models import Account
+
+USERNAME_CACHE_TIMEOUT = getattr(settings, 'USERNAME_CACHE_TIMEOUT', 3600)
+
+
+def username_cache_key(username):
+    return f'user:id:{username}'
+
+
+def get_user_id(username):
+    """
+    Resolve a username to its account id, going to the database only on a cache miss.
+
+    Raises ``Account.DoesNotExist`` for unknown usernames.
+    """
+    key = username_cache_key(username)
+    user_id = cache.get(key)
+    if user_id is None:
+        user_id = Account.objects.filter(username=username).values_list('id', flat=True).first()
+        if user_id is None:
+            raise Account.DoesNotExist(f"User {username} does not exist.")
+        cache.set(key, user_id, USERNAME_CACHE_TIMEOUT)
+    return user_id
+
+
+def remember_username(account):
+    cache.set(username_cache_key(account.username), account.pk, USERNAME_CACHE_TIMEOUT)
+
+
+def forget_username(username):
+    cache.delete(username_cache_key(username))
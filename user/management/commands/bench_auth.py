@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+from chat.management.benchmark import isolated_environment, summarize
+from user import hashing
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Measure logins/sec and latency of the token endpoint under concurrent load.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=hashing.PASSWORD_HASHING_WORKERS,
+                            help='Hashing pool size for the pooled run.')
+
+    def handle(self, *args, **options):
+        with isolated_environment():
+            encoded = make_password('bench-password')
+            User.objects.bulk_create([User(username=f'user{i}', password=encoded) for i in range(options['concurrency'])])
+
+            default_pool = hashing.pool
+            runs = [('inline hashing', hashing.PasswordHashingPool(workers=0)),
+                    (f"pool of {options['workers']} workers", hashing.PasswordHashingPool(workers=options['workers']))]
+            try:
+                for label, pool in runs:
+                    hashing.pool = pool
+                    # Warm up the pool so process start-up is not measured
+                    pool.run(make_password, 'warm-up')
+                    self.run_load(label, options)
+                    pool.shutdown()
+            finally:
+                hashing.pool = default_pool
+
+    def run_load(self, label, options):
+        def login(i):
+            client = APIClient()
+            start = time.perf_counter()
+            response = client.post('/user/token/', {
+                'username': f"user{i % options['concurrency']}",
+                'password': 'bench-password',
+            })
+            return response.status_code, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(login, range(options['requests'])))
+        elapsed = time.perf_counter() - start
+
+        summary = summarize([latency for _, latency in results])
+        rejected = sum(1 for code, _ in results if code == 503)
+        self.stdout.write(f"{label:<24} {len(results) / elapsed:>8.1f} logins/s  p50 {summary['p50_ms']:>8.1f} ms  "
+                          f"p99 {summary['p99_ms']:>8.1f} ms  rejected {rejected}")
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-19 02:16
+
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def populate_username_normalized(apps, schema_editor):
+    Account = apps.get_model('user', 'Account')
+    # Streamed and written a batch at a time so large tables are never held in memory
+    batch = []
+    for account in Account.objects.only('id', 'username').order_by('pk').iterator(chunk_size=BATCH_SIZE):
+        account.username_normalized = account.username.casefold()
+        batch.append(account)
+        if len(batch) == BATCH_SIZE:
+            Account.objects.bulk_update(batch, ['username_normalized'])
+            batch = []
+    if batch:
+        Account.objects.bulk_update(batch, ['username_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0003_account_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='username_normalized',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(populate_username_normalized, migrations.RunPython.noop),
+    ]
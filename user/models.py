@@ -9,6 +9,20 @@ class Account(AbstractUser):
     bio = models.TextField(blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
     last_seen = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Case-folded username backing prefix search in the user directory
+    username_normalized = models.CharField(max_length=150, db_index=True, editable=False, default='')
+
+    def save(self, *args, **kwargs):
+        self.username_normalized = self.normalize_directory_name(self.username)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'username' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'username_normalized'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.username
+
+    @staticmethod
+    def normalize_directory_name(username):
+        return username.casefold()
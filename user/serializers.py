@@ -6,10 +6,17 @@ class AccountSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'bio', 'avatar', 'last_seen')
         read_only_fields = ('last_seen',)
 
+class AccountSlimSerializer(serializers.ModelSerializer):
+    """Minimal projection of an account used by the user directory."""
+    class Meta:
+        model = Account
+        fields = ('id', 'username')
+
 # serializers.py
 
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from .hashing import hash_password
 
 User = get_user_model()
 
@@ -34,7 +41,8 @@ class RegisterSerializer(serializers.ModelSerializer):
             bio=validated_data.get('bio', ''),
             avatar=validated_data.get('avatar', None)
         )
-        user.set_password(validated_data['password'])
+        # Hashed in the hashing pool rather than on the request worker
+        user.password = hash_password(validated_data['password'])
         user.save()
         return user
 
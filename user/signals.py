@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .lookup import forget_username, remember_username
+from .models import Account
+
+
+@receiver(pre_save, sender=Account)
+def account_saving(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+    # A renamed account must stop resolving under its previous name
+    previous = Account.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+    if previous is not None and previous != instance.username:
+        forget_username(previous)
+
+
+@receiver(post_save, sender=Account)
+def account_saved(sender, instance, **kwargs):
+    remember_username(instance)
+
+
+@receiver(post_delete, sender=Account)
+def account_deleted(sender, instance, **kwargs):
+    forget_username(instance.username)
@@ -1,3 +1,85 @@
-from django.test import TestCase
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from .hashing import HashingPoolBusy, PasswordHashingPool
+from .lookup import get_user_id, username_cache_key
+from .models import Account
 
-# Create your tests here.
+
+class UsernameLookupTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.account = Account.objects.create(username='alice')
+
+    def test_resolves_cached_usernames(self):
+        self.assertEqual(get_user_id('alice'), self.account.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_id('alice'), self.account.pk)
+
+    def test_forgets_the_previous_name_on_rename(self):
+        get_user_id('alice')
+        self.account.username = 'alicia'
+        self.account.save()
+
+        self.assertIsNone(cache.get(username_cache_key('alice')))
+        self.assertEqual(get_user_id('alicia'), self.account.pk)
+        with self.assertRaises(Account.DoesNotExist):
+            get_user_id('alice')
+
+    def test_saves_without_the_username_skip_the_lookup(self):
+        with self.assertNumQueries(1):
+            self.account.save(update_fields=['bio'])
+
+    def test_forgets_deleted_accounts(self):
+        get_user_id('alice')
+        self.account.delete()
+        with self.assertRaises(Account.DoesNotExist):
+            get_user_id('alice')
+
+
+class StubExecutor:
+    """Executor answering inline, or failing like a pool whose worker died."""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.shut_down = False
+
+    def submit(self, func, *args):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool('worker died'))
+        else:
+            future.set_result(func(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+class PasswordHashingPoolTests(SimpleTestCase):
+    def pool(self, *executors, **options):
+        pool = PasswordHashingPool(workers=1, **options)
+        pool.get_executor = mock.Mock(side_effect=executors)
+        return pool
+
+    def test_runs_inline_without_workers(self):
+        self.assertEqual(PasswordHashingPool(workers=0).run(str.upper, 'pw'), 'PW')
+
+    def test_replaces_a_broken_pool_and_retries_once(self):
+        broken = StubExecutor(broken=True)
+        pool = self.pool(broken, StubExecutor())
+        self.assertEqual(pool.run(str.upper, 'pw'), 'PW')
+        self.assertTrue(broken.shut_down)
+
+    def test_answers_503_when_the_pool_keeps_breaking(self):
+        pool = self.pool(StubExecutor(broken=True), StubExecutor(broken=True))
+        with self.assertRaises(HashingPoolBusy):
+            pool.run(str.upper, 'pw')
+
+    def test_answers_503_when_the_queue_is_full(self):
+        pool = self.pool(StubExecutor(), queue_size=1, timeout=0.01)
+        pool._slots.acquire()
+        with self.assertRaises(HashingPoolBusy):
+            pool.run(str.upper, 'pw')
@@ -1,12 +1,61 @@
 from rest_framework import viewsets, status
+from rest_framework.pagination import CursorPagination
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from config.conditional import make_etag, not_modified, with_validators
 from .models import Account
-from .serializers import AccountSerializer, RegisterSerializer
+from .serializers import AccountSerializer, AccountSlimSerializer, RegisterSerializer
+
+class UserDirectoryPagination(CursorPagination):
+    ordering = ('username_normalized', 'id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
 
 class CustomUserViewSet(viewsets.ModelViewSet):
+    """
+    User directory. Supports ``?search=<prefix>`` for case-insensitive
+    username prefix search and ``?projection=slim`` for id/username rows.
+    """
     queryset = Account.objects.all()
     serializer_class = AccountSerializer
+    pagination_class = UserDirectoryPagination
+
+    def is_slim(self):
+        return self.request.query_params.get('projection') == 'slim'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        prefix = self.request.query_params.get('search')
+        if prefix:
+            # A range on the normalized column is a prefix match every backend serves from the index
+            prefix = Account.normalize_directory_name(prefix)
+            queryset = queryset.filter(username_normalized__gte=prefix, username_normalized__lt=prefix + '\U0010ffff')
+        if self.is_slim():
+            queryset = queryset.only('id', 'username', 'username_normalized', 'updated_at')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.is_slim():
+            return AccountSlimSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        last_modified = max((account.updated_at for account in page), default=None)
+        etag = make_etag(request.get_full_path(), *((account.pk, account.updated_at.timestamp()) for account in page))
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return with_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = make_etag(instance.pk, instance.updated_at.timestamp())
+        response = not_modified(request, etag, instance.updated_at)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return with_validators(response, etag, instance.updated_at)
 
 class RegisterView(APIView):
     def post(self, request, *args, **kwargs):
@@ -15,4 +64,3 @@ class RegisterView(APIView):
             user = serializer.save()
             return Response({"message": "User registered successfully"}, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-